@@ -1,75 +1,262 @@
 '''
-Business: User authentication - register, login with password, update profile
-Args: event with httpMethod, body containing username, password, display_name, avatar_url
-Returns: HTTP response with user data or error
+Business: User authentication - register, login with password, refresh and revoke tokens, update profile
+Args: event with httpMethod, body containing username, password, display_name, avatar_url or refresh_token
+Returns: HTTP response with user data and tokens or error
 '''
 
 import json
 import os
-import psycopg2
+import time
+import hmac
+import base64
+import binascii
+import secrets
 import hashlib
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+PREFLIGHT_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': ''
+}
+
+CONNECTION_PROBE_AFTER_SECONDS = 30
+
+_conn = None
+_conn_used_at = 0.0
+
+def get_connection():
+    '''
+    One connection per warm instance; psycopg2 is imported on the first request
+    that needs the database, so CORS preflights never pay for it. A connection
+    that sat idle (e.g. while the instance was frozen) is probed first, and one
+    the server or a NAT dropped is replaced within the same call.
+    '''
+    global _conn, _conn_used_at
+    import psycopg2
+    if _conn is not None and not _conn.closed:
+        try:
+            _conn.rollback()
+            if time.monotonic() - _conn_used_at > CONNECTION_PROBE_AFTER_SECONDS:
+                with _conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                _conn.rollback()
+        except psycopg2.Error:
+            _conn.close()
+    if _conn is None or _conn.closed:
+        _conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    _conn_used_at = time.monotonic()
+    return _conn
+
+def release(cur, conn) -> None:
+    cur.close()
+    conn.rollback()
+
+AVATAR_COLORS = ('#0088cc', '#8e44ad', '#e74c3c', '#27ae60', '#f39c12', '#16a085')
+
+ACCESS_TOKEN_TTL_SECONDS = 15 * 60
+REFRESH_TOKEN_TTL_SECONDS = 30 * 24 * 60 * 60
+
+LOGIN_SQL = "SELECT id, username, display_name, avatar_color, avatar_url, bio, password_hash FROM users WHERE username = %s"
+
+REVOKE_REFRESH_TOKEN_SQL = "UPDATE refresh_tokens SET revoked_at = CURRENT_TIMESTAMP WHERE token_hash = %s AND revoked_at IS NULL AND expires_at > CURRENT_TIMESTAMP RETURNING user_id"
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
+def enqueue_job_once(cur, kind: str, payload: Dict[str, Any]) -> None:
+    '''
+    Skips the insert while an identical job is still pending, so housekeeping jobs
+    do not pile up between worker runs.
+    '''
+    cur.execute(
+        "INSERT INTO jobs (kind, payload) SELECT %s, %s::jsonb WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE kind = %s AND payload = %s::jsonb AND status = 'pending')",
+        (kind, json.dumps(payload), kind, json.dumps(payload))
+    )
+
+def b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def issue_access_token(user_id: int) -> str:
+    payload = {
+        'sub': user_id,
+        'jti': secrets.token_hex(16),
+        'exp': int(time.time()) + ACCESS_TOKEN_TTL_SECONDS
+    }
+    payload_part = b64url_encode(json.dumps(payload, separators=(',', ':')).encode())
+    signature = hmac.new(os.environ['TOKEN_SECRET'].encode(), payload_part.encode(), hashlib.sha256).digest()
+    return f"{payload_part}.{b64url_encode(signature)}"
+
+def issue_tokens(cur, user_id: int) -> Dict[str, Any]:
+    refresh_token = secrets.token_urlsafe(32)
+    cur.execute(
+        "INSERT INTO refresh_tokens (user_id, token_hash, expires_at) VALUES (%s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')",
+        (user_id, hashlib.sha256(refresh_token.encode()).hexdigest(), REFRESH_TOKEN_TTL_SECONDS)
+    )
+    return {
+        'access_token': issue_access_token(user_id),
+        'refresh_token': refresh_token,
+        'expires_in': ACCESS_TOKEN_TTL_SECONDS
+    }
+
+def revoke_refresh_token(cur, refresh_token: str) -> Optional[Tuple[int]]:
+    cur.execute(REVOKE_REFRESH_TOKEN_SQL, (hashlib.sha256(refresh_token.encode()).hexdigest(),))
+    return cur.fetchone()
+
+DENY_LIST_TTL_SECONDS = 30
+
+DENY_LIST_SQL = "SELECT jti FROM revoked_tokens WHERE expires_at > CURRENT_TIMESTAMP"
+
+_deny_list: Dict[str, Any] = {'jtis': frozenset(), 'loaded_at': None}
+
+def b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def verify_access_token(token: str) -> Optional[Dict[str, Any]]:
+    try:
+        payload_part, signature_part = token.split('.')
+        signature = b64url_decode(signature_part)
+    except (ValueError, binascii.Error):
+        return None
+    expected = hmac.new(os.environ['TOKEN_SECRET'].encode(), payload_part.encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        return None
+    payload = json.loads(b64url_decode(payload_part))
+    if payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+def is_token_revoked(cur, jti: str) -> bool:
+    loaded_at = _deny_list['loaded_at']
+    if loaded_at is None or time.monotonic() - loaded_at > DENY_LIST_TTL_SECONDS:
+        cur.execute(DENY_LIST_SQL)
+        _deny_list['jtis'] = frozenset(row[0] for row in cur.fetchall())
+        _deny_list['loaded_at'] = time.monotonic()
+    return jti in _deny_list['jtis']
+
+def authenticate(event: Dict[str, Any], cur) -> Optional[int]:
+    '''
+    Signature and expiry are checked locally; the deny-list is refreshed at most
+    every DENY_LIST_TTL_SECONDS per warm instance.
+    '''
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    token = headers.get('x-auth-token')
+    if not token:
+        return None
+    payload = verify_access_token(token)
+    if not payload or is_token_revoked(cur, payload['jti']):
+        return None
+    return int(payload['sub'])
+
+def unauthorized(cur, conn) -> Dict[str, Any]:
+    release(cur, conn)
+    return {
+        'statusCode': 401,
+        'headers': dict(JSON_HEADERS),
+        'body': json.dumps({'error': 'Invalid or expired token'})
+    }
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return dict(PREFLIGHT_RESPONSE, headers=dict(PREFLIGHT_RESPONSE['headers']))
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_connection()
     cur = conn.cursor()
     
     if method == 'POST':
         body_data = json.loads(event.get('body', '{}'))
         action = body_data.get('action', 'login')
+        
+        if action in ('refresh', 'logout'):
+            refresh_token = body_data.get('refresh_token', '').strip()
+            if not refresh_token:
+                release(cur, conn)
+                return {
+                    'statusCode': 400,
+                    'headers': dict(JSON_HEADERS),
+                    'body': json.dumps({'error': 'refresh_token required'})
+                }
+            
+            session = revoke_refresh_token(cur, refresh_token)
+            
+            if action == 'logout':
+                headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+                payload = verify_access_token(headers.get('x-auth-token', ''))
+                if payload:
+                    cur.execute(
+                        "INSERT INTO revoked_tokens (jti, expires_at) VALUES (%s, to_timestamp(%s)) ON CONFLICT DO NOTHING",
+                        (payload['jti'], payload['exp'])
+                    )
+                enqueue_job_once(cur, 'purge_expired_tokens', {})
+                conn.commit()
+                release(cur, conn)
+                return {
+                    'statusCode': 200,
+                    'headers': dict(JSON_HEADERS),
+                    'body': json.dumps({'success': True}),
+                    'isBase64Encoded': False
+                }
+            
+            if not session:
+                conn.commit()
+                release(cur, conn)
+                return {
+                    'statusCode': 401,
+                    'headers': dict(JSON_HEADERS),
+                    'body': json.dumps({'error': 'Invalid or expired refresh token'})
+                }
+            
+            result = issue_tokens(cur, session[0])
+            conn.commit()
+            release(cur, conn)
+            
+            return {
+                'statusCode': 200,
+                'headers': dict(JSON_HEADERS),
+                'body': json.dumps(result),
+                'isBase64Encoded': False
+            }
+        
         username = body_data.get('username', '').strip()
         password = body_data.get('password', '').strip()
         
         if not username or not password:
-            cur.close()
-            conn.close()
+            release(cur, conn)
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': dict(JSON_HEADERS),
                 'body': json.dumps({'error': 'Username and password required'})
             }
         
         if action == 'register':
             display_name = body_data.get('display_name', '').strip()
             if not display_name:
-                cur.close()
-                conn.close()
+                release(cur, conn)
                 return {
                     'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': dict(JSON_HEADERS),
                     'body': json.dumps({'error': 'Display name required'})
                 }
             
             cur.execute("SELECT id FROM users WHERE username = %s", (username,))
             if cur.fetchone():
-                cur.close()
-                conn.close()
+                release(cur, conn)
                 return {
                     'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': dict(JSON_HEADERS),
                     'body': json.dumps({'error': 'Username already exists'})
                 }
             
-            avatar_colors = ['#0088cc', '#8e44ad', '#e74c3c', '#27ae60', '#f39c12', '#16a085']
-            import random
-            color = random.choice(avatar_colors)
+            color = secrets.choice(AVATAR_COLORS)
             password_hash = hash_password(password)
             
             cur.execute(
@@ -77,16 +264,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 (username, display_name, color, password_hash)
             )
             user = cur.fetchone()
-            conn.commit()
-            
-            cur.execute("SELECT id FROM chats WHERE name = 'Общий чат'")
-            general_chat = cur.fetchone()
-            if general_chat:
-                cur.execute(
-                    "INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
-                    (general_chat[0], user[0])
-                )
-                conn.commit()
+            cur.execute(
+                "INSERT INTO chat_members (chat_id, user_id) SELECT id, %s FROM chats WHERE name = 'Общий чат' AND created_by IS NULL ORDER BY id LIMIT 1 ON CONFLICT DO NOTHING",
+                (user[0],)
+            )
             
             result = {
                 'id': user[0],
@@ -99,18 +280,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         elif action == 'login':
             password_hash = hash_password(password)
-            cur.execute(
-                "SELECT id, username, display_name, avatar_color, avatar_url, bio, password_hash FROM users WHERE username = %s",
-                (username,)
-            )
+            cur.execute(LOGIN_SQL, (username,))
             user = cur.fetchone()
             
             if not user or user[6] != password_hash:
-                cur.close()
-                conn.close()
+                release(cur, conn)
                 return {
                     'statusCode': 401,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': dict(JSON_HEADERS),
                     'body': json.dumps({'error': 'Invalid username or password'})
                 }
             
@@ -126,32 +303,27 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'bio': user[5]
             }
         
-        cur.close()
-        conn.close()
+        result.update(issue_tokens(cur, result['id']))
+        conn.commit()
+        release(cur, conn)
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': dict(JSON_HEADERS),
             'body': json.dumps(result),
             'isBase64Encoded': False
         }
     
     if method == 'PUT':
+        user_id = authenticate(event, cur)
+        if not user_id:
+            return unauthorized(cur, conn)
+        
         body_data = json.loads(event.get('body', '{}'))
-        user_id = body_data.get('user_id')
         avatar_url = body_data.get('avatar_url')
         display_name = body_data.get('display_name')
         bio = body_data.get('bio')
         
-        if not user_id:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'user_id required'})
-            }
-        
         updates = []
         params = []
         
@@ -183,21 +355,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'bio': user[5]
             }
             
-            cur.close()
-            conn.close()
+            release(cur, conn)
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': dict(JSON_HEADERS),
                 'body': json.dumps(result),
                 'isBase64Encoded': False
             }
     
-    cur.close()
-    conn.close()
+    release(cur, conn)
     
     return {
         'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'headers': dict(JSON_HEADERS),
         'body': json.dumps({'error': 'Method not allowed'})
     }
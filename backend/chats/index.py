@@ -1,55 +1,219 @@
 '''
 Business: Get user chats, create private chats and channels
-Args: event with httpMethod, queryStringParameters with user_id, body for creating chats
+Args: event with httpMethod, X-Auth-Token header, queryStringParameters with search, body for creating chats
 Returns: HTTP response with chats list or created chat data
 '''
 
 import json
 import os
-import psycopg2
-from typing import Dict, Any
+import time
+import hmac
+import base64
+import binascii
+import hashlib
+from typing import Dict, Any, Optional
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+PREFLIGHT_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': ''
+}
+
+CHAT_SEARCH_SQL = """
+    SELECT c.id, c.name, c.type, c.username, c.avatar_url, c.description, c.created_at
+    FROM chats c
+    WHERE (c.username ILIKE %s OR c.name ILIKE %s)
+    AND c.type IN ('channel', 'group')
+    ORDER BY c.created_at DESC
+    LIMIT 50
+"""
+
+# $n placeholders: runs only as execute_prepared(cur, 'chat_list', ...)
+CHAT_LIST_SQL = """
+    SELECT c.id, c.name, c.type, c.created_at, c.username, c.avatar_url,
+           (SELECT content FROM messages WHERE chat_id = c.id AND removed_at IS NULL ORDER BY id DESC LIMIT 1) as last_message,
+           (SELECT created_at FROM messages WHERE chat_id = c.id AND removed_at IS NULL ORDER BY id DESC LIMIT 1) as last_message_time,
+           (SELECT message_type FROM messages WHERE chat_id = c.id AND removed_at IS NULL ORDER BY id DESC LIMIT 1) as last_message_type,
+           cm.unread_count
+    FROM chats c
+    INNER JOIN chat_members cm ON c.id = cm.chat_id
+    WHERE cm.user_id = $1
+    ORDER BY last_message_time DESC NULLS LAST, c.created_at DESC
+"""
+
+# $n placeholders: runs only as execute_prepared(cur, 'private_peer', ...)
+PRIVATE_PEER_SQL = """
+    SELECT u.id, u.username, u.display_name, u.avatar_color, u.avatar_url, u.is_online
+    FROM users u
+    INNER JOIN chat_members cm ON u.id = cm.user_id
+    WHERE cm.chat_id = $1 AND u.id != $2
+    LIMIT 1
+"""
+
+EXISTING_PRIVATE_CHAT_SQL = """
+    SELECT c.id FROM chats c
+    INNER JOIN chat_members cm1 ON c.id = cm1.chat_id
+    INNER JOIN chat_members cm2 ON c.id = cm2.chat_id
+    WHERE c.type = 'private'
+    AND cm1.user_id = %s
+    AND cm2.user_id = %s
+    LIMIT 1
+"""
+
+CHAT_BY_ID_SQL = """
+    SELECT c.id, c.name, c.type, c.created_at
+    FROM chats c
+    WHERE c.id = %s
+"""
+
+# Every other *_SQL constant uses %s placeholders and goes through cur.execute()
+PREPARED_STATEMENTS = {
+    'chat_list': ('integer', CHAT_LIST_SQL),
+    'private_peer': ('integer, integer', PRIVATE_PEER_SQL),
+}
+
+CONNECTION_PROBE_AFTER_SECONDS = 30
+
+_conn = None
+_conn_used_at = 0.0
+
+def get_connection():
+    '''
+    One connection per warm instance; psycopg2 is imported on the first request
+    that needs the database, so CORS preflights never pay for it. A connection
+    that sat idle (e.g. while the instance was frozen) is probed first, and one
+    the server or a NAT dropped is replaced within the same call.
+    '''
+    global _conn, _conn_used_at
+    import psycopg2
+    if _conn is not None and not _conn.closed:
+        try:
+            _conn.rollback()
+            if time.monotonic() - _conn_used_at > CONNECTION_PROBE_AFTER_SECONDS:
+                with _conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                _conn.rollback()
+        except psycopg2.Error:
+            _conn.close()
+    if _conn is None or _conn.closed:
+        _conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    _conn_used_at = time.monotonic()
+    return _conn
+
+def release(cur, conn) -> None:
+    cur.close()
+    conn.rollback()
+
+_prepared: Dict[str, Any] = {'conn': None, 'names': set()}
+
+def execute_prepared(cur, name: str, params: tuple) -> None:
+    '''
+    PREPAREs the statement once per connection and runs it with EXECUTE. A new
+    connection starts an empty registry; a statement lost by the server (26000)
+    or invalidated by a schema change (0A000) is re-prepared and retried once.
+    The retry rolls back the open transaction, so use it for reads only.
+    '''
+    import psycopg2
+    conn = cur.connection
+    if _prepared['conn'] is not conn:
+        _prepared['conn'] = conn
+        _prepared['names'] = set()
+    names = _prepared['names']
+    arg_types, sql = PREPARED_STATEMENTS[name]
+    placeholders = ', '.join(['%s'] * len(params))
+    for attempt in range(2):
+        try:
+            if name not in names:
+                cur.execute(f"PREPARE {name} ({arg_types}) AS {sql}")
+                names.add(name)
+            cur.execute(f"EXECUTE {name} ({placeholders})", params)
+            return
+        except psycopg2.Error as e:
+            if attempt or e.pgcode not in ('26000', '0A000'):
+                raise
+            conn.rollback()
+            cur.execute("DEALLOCATE ALL")
+            names.clear()
+
+DENY_LIST_TTL_SECONDS = 30
+
+DENY_LIST_SQL = "SELECT jti FROM revoked_tokens WHERE expires_at > CURRENT_TIMESTAMP"
+
+_deny_list: Dict[str, Any] = {'jtis': frozenset(), 'loaded_at': None}
+
+def b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def verify_access_token(token: str) -> Optional[Dict[str, Any]]:
+    try:
+        payload_part, signature_part = token.split('.')
+        signature = b64url_decode(signature_part)
+    except (ValueError, binascii.Error):
+        return None
+    expected = hmac.new(os.environ['TOKEN_SECRET'].encode(), payload_part.encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        return None
+    payload = json.loads(b64url_decode(payload_part))
+    if payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+def is_token_revoked(cur, jti: str) -> bool:
+    loaded_at = _deny_list['loaded_at']
+    if loaded_at is None or time.monotonic() - loaded_at > DENY_LIST_TTL_SECONDS:
+        cur.execute(DENY_LIST_SQL)
+        _deny_list['jtis'] = frozenset(row[0] for row in cur.fetchall())
+        _deny_list['loaded_at'] = time.monotonic()
+    return jti in _deny_list['jtis']
+
+def authenticate(event: Dict[str, Any], cur) -> Optional[int]:
+    '''
+    Signature and expiry are checked locally; the deny-list is refreshed at most
+    every DENY_LIST_TTL_SECONDS per warm instance.
+    '''
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    token = headers.get('x-auth-token')
+    if not token:
+        return None
+    payload = verify_access_token(token)
+    if not payload or is_token_revoked(cur, payload['jti']):
+        return None
+    return int(payload['sub'])
+
+def unauthorized(cur, conn) -> Dict[str, Any]:
+    release(cur, conn)
+    return {
+        'statusCode': 401,
+        'headers': dict(JSON_HEADERS),
+        'body': json.dumps({'error': 'Invalid or expired token'})
+    }
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return dict(PREFLIGHT_RESPONSE, headers=dict(PREFLIGHT_RESPONSE['headers']))
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_connection()
     cur = conn.cursor()
     
+    user_id = authenticate(event, cur)
+    if not user_id:
+        return unauthorized(cur, conn)
+    
     if method == 'GET':
         params = event.get('queryStringParameters', {})
-        user_id = params.get('user_id')
         search_query = params.get('search', '').strip()
         
-        if not user_id and not search_query:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'user_id or search required'})
-            }
-        
         if search_query:
-            cur.execute("""
-                SELECT c.id, c.name, c.type, c.username, c.avatar_url, c.description, c.created_at
-                FROM chats c
-                WHERE (c.username ILIKE %s OR c.name ILIKE %s)
-                AND c.type IN ('channel', 'group')
-                ORDER BY c.created_at DESC
-                LIMIT 50
-            """, (f'%{search_query}%', f'%{search_query}%'))
+            cur.execute(CHAT_SEARCH_SQL, (f'%{search_query}%', f'%{search_query}%'))
             
             results = []
             for row in cur.fetchall():
@@ -63,36 +227,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'created_at': row[6].isoformat() if row[6] else None
                 })
             
-            cur.close()
-            conn.close()
+            release(cur, conn)
             
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': dict(JSON_HEADERS),
                 'body': json.dumps(results),
                 'isBase64Encoded': False
             }
         
-        if not user_id:
-            cur.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'user_id required'})
-            }
-        
-        cur.execute("""
-            SELECT c.id, c.name, c.type, c.created_at, c.username, c.avatar_url,
-                   (SELECT content FROM messages WHERE chat_id = c.id AND removed_at IS NULL ORDER BY created_at DESC LIMIT 1) as last_message,
-                   (SELECT created_at FROM messages WHERE chat_id = c.id AND removed_at IS NULL ORDER BY created_at DESC LIMIT 1) as last_message_time,
-                   (SELECT message_type FROM messages WHERE chat_id = c.id AND removed_at IS NULL ORDER BY created_at DESC LIMIT 1) as last_message_type,
-                   cm.unread_count
-            FROM chats c
-            INNER JOIN chat_members cm ON c.id = cm.chat_id
-            WHERE cm.user_id = %s
-            ORDER BY last_message_time DESC NULLS LAST, c.created_at DESC
-        """, (user_id,))
+        execute_prepared(cur, 'chat_list', (user_id,))
         
         chats = []
         for row in cur.fetchall():
@@ -110,13 +254,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
             
             if chat_data['type'] == 'private':
-                cur.execute("""
-                    SELECT u.id, u.username, u.display_name, u.avatar_color, u.avatar_url, u.is_online
-                    FROM users u
-                    INNER JOIN chat_members cm ON u.id = cm.user_id
-                    WHERE cm.chat_id = %s AND u.id != %s
-                    LIMIT 1
-                """, (chat_data['id'], user_id))
+                execute_prepared(cur, 'private_peer', (chat_data['id'], user_id))
                 other_user = cur.fetchone()
                 if other_user:
                     chat_data['other_user'] = {
@@ -130,12 +268,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             chats.append(chat_data)
         
-        cur.close()
-        conn.close()
+        release(cur, conn)
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': dict(JSON_HEADERS),
             'body': json.dumps(chats),
             'isBase64Encoded': False
         }
@@ -143,53 +280,63 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if method == 'POST':
         body_data = json.loads(event.get('body', '{}'))
         chat_type = body_data.get('type', 'channel')
-        user_id = body_data.get('user_id')
         
-        if not user_id:
-            cur.close()
-            conn.close()
+        if body_data.get('action') == 'join':
+            chat_id = body_data.get('chat_id')
+            cur.execute("SELECT id, name, type, created_at, username, avatar_url FROM chats WHERE id = %s", (chat_id,))
+            chat = cur.fetchone()
+            
+            if not chat or chat[2] == 'private':
+                release(cur, conn)
+                return {
+                    'statusCode': 404,
+                    'headers': dict(JSON_HEADERS),
+                    'body': json.dumps({'error': 'Chat not found'})
+                }
+            
+            cur.execute(
+                "INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                (chat[0], user_id)
+            )
+            conn.commit()
+            release(cur, conn)
+            
             return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'user_id required'})
+                'statusCode': 200,
+                'headers': dict(JSON_HEADERS),
+                'body': json.dumps({
+                    'id': chat[0],
+                    'name': chat[1],
+                    'type': chat[2],
+                    'created_at': chat[3].isoformat(),
+                    'username': chat[4],
+                    'avatar_url': chat[5]
+                }),
+                'isBase64Encoded': False
             }
         
         if chat_type == 'private':
             other_user_id = body_data.get('other_user_id')
             if not other_user_id:
-                cur.close()
-                conn.close()
+                release(cur, conn)
                 return {
                     'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': dict(JSON_HEADERS),
                     'body': json.dumps({'error': 'other_user_id required for private chat'})
                 }
             
-            cur.execute("""
-                SELECT c.id FROM chats c
-                INNER JOIN chat_members cm1 ON c.id = cm1.chat_id
-                INNER JOIN chat_members cm2 ON c.id = cm2.chat_id
-                WHERE c.type = 'private'
-                AND cm1.user_id = %s
-                AND cm2.user_id = %s
-                LIMIT 1
-            """, (user_id, other_user_id))
+            cur.execute(EXISTING_PRIVATE_CHAT_SQL, (user_id, other_user_id))
             
             existing_chat = cur.fetchone()
             if existing_chat:
-                cur.execute("""
-                    SELECT c.id, c.name, c.type, c.created_at
-                    FROM chats c
-                    WHERE c.id = %s
-                """, (existing_chat[0],))
+                cur.execute(CHAT_BY_ID_SQL, (existing_chat[0],))
                 chat = cur.fetchone()
                 
-                cur.close()
-                conn.close()
+                release(cur, conn)
                 
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': dict(JSON_HEADERS),
                     'body': json.dumps({
                         'id': chat[0],
                         'name': chat[1],
@@ -220,32 +367,29 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             avatar_url = body_data.get('avatar_url', '').strip()
             
             if not name:
-                cur.close()
-                conn.close()
+                release(cur, conn)
                 return {
                     'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'headers': dict(JSON_HEADERS),
                     'body': json.dumps({'error': 'name required'})
                 }
             
             if username:
                 cur.execute("SELECT id FROM chats WHERE username = %s", (username,))
                 if cur.fetchone():
-                    cur.close()
-                    conn.close()
+                    release(cur, conn)
                     return {
                         'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'headers': dict(JSON_HEADERS),
                         'body': json.dumps({'error': 'Username already taken'})
                     }
                 
                 cur.execute("SELECT id FROM users WHERE username = %s", (username,))
                 if cur.fetchone():
-                    cur.close()
-                    conn.close()
+                    release(cur, conn)
                     return {
                         'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'headers': dict(JSON_HEADERS),
                         'body': json.dumps({'error': 'Username already taken by user'})
                     }
             
@@ -258,8 +402,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s)", (chat[0], user_id))
             conn.commit()
         
-        cur.close()
-        conn.close()
+        release(cur, conn)
         
         result = {
             'id': chat[0],
@@ -272,7 +415,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': dict(JSON_HEADERS),
             'body': json.dumps(result),
             'isBase64Encoded': False
         }
@@ -280,27 +423,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if method == 'PUT':
         body_data = json.loads(event.get('body', '{}'))
         chat_id = body_data.get('chat_id')
-        user_id = body_data.get('user_id')
         avatar_url = body_data.get('avatar_url')
         
-        if not chat_id or not user_id:
-            cur.close()
-            conn.close()
+        if not chat_id:
+            release(cur, conn)
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'chat_id and user_id required'})
+                'headers': dict(JSON_HEADERS),
+                'body': json.dumps({'error': 'chat_id required'})
             }
         
         cur.execute("SELECT created_by FROM chats WHERE id = %s", (chat_id,))
         chat = cur.fetchone()
         
-        if not chat or chat[0] != int(user_id):
-            cur.close()
-            conn.close()
+        if not chat or chat[0] != user_id:
+            release(cur, conn)
             return {
                 'statusCode': 403,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': dict(JSON_HEADERS),
                 'body': json.dumps({'error': 'Only creator can update chat'})
             }
         
@@ -309,21 +449,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             (avatar_url, chat_id)
         )
         conn.commit()
-        cur.close()
-        conn.close()
+        release(cur, conn)
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': dict(JSON_HEADERS),
             'body': json.dumps({'success': True}),
             'isBase64Encoded': False
         }
     
-    cur.close()
-    conn.close()
+    release(cur, conn)
     
     return {
         'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'headers': dict(JSON_HEADERS),
         'body': json.dumps({'error': 'Method not allowed'})
     }
\ No newline at end of file
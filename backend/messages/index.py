@@ -1,56 +1,315 @@
 '''
-Business: Send, retrieve, and delete messages in chats
-Args: event with httpMethod, queryStringParameters with chat_id/message_id, body for sending messages
+Business: Send, retrieve, react to and delete messages in chats
+Args: event with httpMethod, X-Auth-Token header, queryStringParameters with chat_id (before_id for older pages)/message_id, body for sending messages
 Returns: HTTP response with messages list or sent message data
 '''
 
 import json
 import os
-import psycopg2
-from typing import Dict, Any
+import time
+import bisect
+import hmac
+import base64
+import binascii
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Any, FrozenSet, Optional, Tuple
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+PREFLIGHT_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': ''
+}
+
+# One page of history, read backwards off idx_messages_chat_id_live and reversed in the handler;
+# before_id pages further back, and the poll without it always gets the newest page
+HISTORY_LIMIT = 200
+NEWEST_PAGE_BEFORE_ID = 2 ** 31 - 1
+
+# $n placeholders: runs only as execute_prepared(cur, 'history', ...)
+HISTORY_SQL = """
+    SELECT m.id, m.content, m.message_type, m.created_at, m.media_url,
+           u.id as user_id, u.username, u.display_name, u.avatar_color, u.avatar_url,
+           m.reactions
+    FROM messages m
+    INNER JOIN users u ON m.user_id = u.id
+    WHERE m.chat_id = $1 AND m.removed_at IS NULL AND m.id < $3
+    ORDER BY m.id DESC
+    LIMIT $2
+"""
+
+# $n placeholders: runs only as execute_prepared(cur, 'read_watermarks', ...)
+READ_WATERMARKS_SQL = """
+    SELECT user_id, last_read_message_id
+    FROM chat_members
+    WHERE chat_id = $1
+"""
+
+ADJUST_REACTION_SQL = """
+    UPDATE messages
+    SET reactions = CASE
+        WHEN COALESCE((reactions->>%(emoji)s)::int, 0) + %(delta)s > 0
+        THEN jsonb_set(reactions, ARRAY[%(emoji)s], to_jsonb(COALESCE((reactions->>%(emoji)s)::int, 0) + %(delta)s))
+        ELSE reactions - %(emoji)s
+    END
+    WHERE id = %(message_id)s
+"""
+
+# Must match QUICK_REACTIONS in src/pages/Index.tsx
+ALLOWED_REACTIONS = frozenset({'👍', '❤️', '😂', '🔥'})
+
+MESSAGE_CHAT_SQL = "SELECT chat_id FROM messages WHERE id = %s AND removed_at IS NULL"
+
+LOCK_MESSAGE_SQL = "SELECT id FROM messages WHERE id = %s AND removed_at IS NULL FOR UPDATE"
+
+USER_REACTION_SQL = "SELECT emoji FROM message_reactions WHERE message_id = %s AND user_id = %s"
+
+REMOVE_MESSAGE_SQL = "UPDATE messages SET removed_at = CURRENT_TIMESTAMP WHERE id = %s AND user_id = %s RETURNING id"
+
+# Every other *_SQL constant uses %s placeholders and goes through cur.execute()
+PREPARED_STATEMENTS = {
+    'history': ('integer, integer, integer', HISTORY_SQL),
+    'read_watermarks': ('integer', READ_WATERMARKS_SQL),
+}
+
+CONNECTION_PROBE_AFTER_SECONDS = 30
+
+_conn = None
+_conn_used_at = 0.0
+
+def get_connection():
+    '''
+    One connection per warm instance; psycopg2 is imported on the first request
+    that needs the database, so CORS preflights never pay for it. A connection
+    that sat idle (e.g. while the instance was frozen) is probed first, and one
+    the server or a NAT dropped is replaced within the same call.
+    '''
+    global _conn, _conn_used_at
+    import psycopg2
+    if _conn is not None and not _conn.closed:
+        try:
+            _conn.rollback()
+            if time.monotonic() - _conn_used_at > CONNECTION_PROBE_AFTER_SECONDS:
+                with _conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                _conn.rollback()
+        except psycopg2.Error:
+            _conn.close()
+    if _conn is None or _conn.closed:
+        _conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    _conn_used_at = time.monotonic()
+    return _conn
+
+def release(cur, conn) -> None:
+    cur.close()
+    conn.rollback()
+
+_prepared: Dict[str, Any] = {'conn': None, 'names': set()}
+
+def execute_prepared(cur, name: str, params: tuple) -> None:
+    '''
+    PREPAREs the statement once per connection and runs it with EXECUTE. A new
+    connection starts an empty registry; a statement lost by the server (26000)
+    or invalidated by a schema change (0A000) is re-prepared and retried once.
+    The retry rolls back the open transaction, so use it for reads only.
+    '''
+    import psycopg2
+    conn = cur.connection
+    if _prepared['conn'] is not conn:
+        _prepared['conn'] = conn
+        _prepared['names'] = set()
+    names = _prepared['names']
+    arg_types, sql = PREPARED_STATEMENTS[name]
+    placeholders = ', '.join(['%s'] * len(params))
+    for attempt in range(2):
+        try:
+            if name not in names:
+                cur.execute(f"PREPARE {name} ({arg_types}) AS {sql}")
+                names.add(name)
+            cur.execute(f"EXECUTE {name} ({placeholders})", params)
+            return
+        except psycopg2.Error as e:
+            if attempt or e.pgcode not in ('26000', '0A000'):
+                raise
+            conn.rollback()
+            cur.execute("DEALLOCATE ALL")
+            names.clear()
+
+MEMBERSHIP_CACHE_SIZE = 5000
+MEMBERSHIP_TTL_SECONDS = 60
+NON_MEMBER_TTL_SECONDS = 5
+
+# user_id -> (chat ids the user belongs to, version stamp of the load)
+_membership_cache: 'OrderedDict[int, Tuple[FrozenSet[int], float]]' = OrderedDict()
+
+# (user_id, chat_id) -> when a denial was confirmed against the database
+_non_member_cache: 'OrderedDict[Tuple[int, int], float]' = OrderedDict()
+
+MEMBERSHIPS_SQL = "SELECT chat_id FROM chat_members WHERE user_id = %s"
+
+def load_memberships(cur, user_id: int) -> FrozenSet[int]:
+    cur.execute(MEMBERSHIPS_SQL, (user_id,))
+    chat_ids = frozenset(row[0] for row in cur.fetchall())
+    _membership_cache[user_id] = (chat_ids, time.monotonic())
+    _membership_cache.move_to_end(user_id)
+    while len(_membership_cache) > MEMBERSHIP_CACHE_SIZE:
+        _membership_cache.popitem(last=False)
+    return chat_ids
+
+def is_chat_member(cur, user_id: int, chat_id: int, use_denial_cache: bool = True) -> bool:
+    '''
+    Membership lives in a warm-instance cache, so the 2-second poll costs a dict lookup.
+    Members are only ever added (by the chats function), so a miss or a stale stamp
+    reloads the user's chat set from the database before denying access. Confirmed
+    denials are remembered for NON_MEMBER_TTL_SECONDS so a non-member polling a chat
+    does not turn every poll into a round trip; writes pass use_denial_cache=False
+    so a send or reaction right after joining always sees the new membership.
+    '''
+    now = time.monotonic()
+    cached = _membership_cache.get(user_id)
+    if cached:
+        chat_ids, loaded_at = cached
+        if now - loaded_at < MEMBERSHIP_TTL_SECONDS:
+            _membership_cache.move_to_end(user_id)
+            if chat_id in chat_ids:
+                return True
+    
+    denied_at = _non_member_cache.get((user_id, chat_id))
+    if use_denial_cache and denied_at is not None and now - denied_at < NON_MEMBER_TTL_SECONDS:
+        return False
+    
+    if chat_id in load_memberships(cur, user_id):
+        _non_member_cache.pop((user_id, chat_id), None)
+        return True
+    
+    _non_member_cache[(user_id, chat_id)] = now
+    _non_member_cache.move_to_end((user_id, chat_id))
+    while len(_non_member_cache) > MEMBERSHIP_CACHE_SIZE:
+        _non_member_cache.popitem(last=False)
+    return False
+
+DENY_LIST_TTL_SECONDS = 30
+
+DENY_LIST_SQL = "SELECT jti FROM revoked_tokens WHERE expires_at > CURRENT_TIMESTAMP"
+
+_deny_list: Dict[str, Any] = {'jtis': frozenset(), 'loaded_at': None}
+
+def b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def verify_access_token(token: str) -> Optional[Dict[str, Any]]:
+    try:
+        payload_part, signature_part = token.split('.')
+        signature = b64url_decode(signature_part)
+    except (ValueError, binascii.Error):
+        return None
+    expected = hmac.new(os.environ['TOKEN_SECRET'].encode(), payload_part.encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        return None
+    payload = json.loads(b64url_decode(payload_part))
+    if payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+def is_token_revoked(cur, jti: str) -> bool:
+    loaded_at = _deny_list['loaded_at']
+    if loaded_at is None or time.monotonic() - loaded_at > DENY_LIST_TTL_SECONDS:
+        cur.execute(DENY_LIST_SQL)
+        _deny_list['jtis'] = frozenset(row[0] for row in cur.fetchall())
+        _deny_list['loaded_at'] = time.monotonic()
+    return jti in _deny_list['jtis']
+
+def authenticate(event: Dict[str, Any], cur) -> Optional[int]:
+    '''
+    Signature and expiry are checked locally; the deny-list is refreshed at most
+    every DENY_LIST_TTL_SECONDS per warm instance.
+    '''
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    token = headers.get('x-auth-token')
+    if not token:
+        return None
+    payload = verify_access_token(token)
+    if not payload or is_token_revoked(cur, payload['jti']):
+        return None
+    return int(payload['sub'])
+
+def unauthorized(cur, conn) -> Dict[str, Any]:
+    release(cur, conn)
+    return {
+        'statusCode': 401,
+        'headers': dict(JSON_HEADERS),
+        'body': json.dumps({'error': 'Invalid or expired token'})
+    }
+
+def adjust_reaction(cur, message_id: int, emoji: str, delta: int) -> None:
+    cur.execute(ADJUST_REACTION_SQL, {'message_id': message_id, 'emoji': emoji, 'delta': delta})
+
+def forbidden(cur, conn) -> Dict[str, Any]:
+    release(cur, conn)
+    return {
+        'statusCode': 403,
+        'headers': dict(JSON_HEADERS),
+        'body': json.dumps({'error': 'You are not a member of this chat'})
+    }
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return dict(PREFLIGHT_RESPONSE, headers=dict(PREFLIGHT_RESPONSE['headers']))
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_connection()
     cur = conn.cursor()
     
+    user_id = authenticate(event, cur)
+    if not user_id:
+        return unauthorized(cur, conn)
+    
     if method == 'GET':
         params = event.get('queryStringParameters', {})
         chat_id = params.get('chat_id')
         
         if not chat_id:
-            cur.close()
-            conn.close()
+            release(cur, conn)
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': dict(JSON_HEADERS),
                 'body': json.dumps({'error': 'chat_id required'})
             }
         
-        cur.execute("""
-            SELECT m.id, m.content, m.message_type, m.created_at, m.media_url,
-                   u.id as user_id, u.username, u.display_name, u.avatar_color, u.avatar_url
-            FROM messages m
-            INNER JOIN users u ON m.user_id = u.id
-            WHERE m.chat_id = %s AND m.removed_at IS NULL
-            ORDER BY m.created_at ASC
-        """, (chat_id,))
+        if not is_chat_member(cur, user_id, int(chat_id)):
+            return forbidden(cur, conn)
+        
+        before_id = int(params.get('before_id') or NEWEST_PAGE_BEFORE_ID)
+        execute_prepared(cur, 'history', (chat_id, HISTORY_LIMIT, before_id))
+        rows = cur.fetchall()[::-1]
+        
+        execute_prepared(cur, 'read_watermarks', (chat_id,))
+        watermarks = dict(cur.fetchall())
+        
+        if rows and watermarks.get(user_id, 0) < rows[-1][0]:
+            watermarks[user_id] = rows[-1][0]
+            cur.execute(
+                "UPDATE chat_members SET last_read_message_id = %s WHERE chat_id = %s AND user_id = %s AND last_read_message_id < %s",
+                (rows[-1][0], chat_id, user_id, rows[-1][0])
+            )
+            conn.commit()
+        
+        # seen_count per message = members other than the author whose watermark reached it
+        marks = sorted(watermarks.values())
         
         messages = []
-        for row in cur.fetchall():
+        for row in rows:
+            seen_count = len(marks) - bisect.bisect_left(marks, row[0])
+            if watermarks.get(row[5], 0) >= row[0]:
+                seen_count -= 1
             messages.append({
                 'id': row[0],
                 'content': row[1],
@@ -63,56 +322,112 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'display_name': row[7],
                     'avatar_color': row[8],
                     'avatar_url': row[9]
-                }
+                },
+                'reactions': row[10],
+                'seen_count': seen_count
             })
         
-        cur.close()
-        conn.close()
+        release(cur, conn)
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': dict(JSON_HEADERS),
             'body': json.dumps(messages),
             'isBase64Encoded': False
         }
     
+    if method == 'PUT':
+        body_data = json.loads(event.get('body', '{}'))
+        message_id = body_data.get('message_id')
+        emoji = body_data.get('emoji') or ''
+        
+        if not message_id or not isinstance(emoji, str) or (emoji and emoji not in ALLOWED_REACTIONS):
+            release(cur, conn)
+            return {
+                'statusCode': 400,
+                'headers': dict(JSON_HEADERS),
+                'body': json.dumps({'error': 'message_id and an allowed reaction required'})
+            }
+        
+        cur.execute(MESSAGE_CHAT_SQL, (message_id,))
+        message = cur.fetchone()
+        
+        if message and not is_chat_member(cur, user_id, message[0], use_denial_cache=False):
+            return forbidden(cur, conn)
+        
+        # Only members get here; locking the message row serialises concurrent reaction changes on it
+        if message:
+            cur.execute(LOCK_MESSAGE_SQL, (message_id,))
+            message = cur.fetchone()
+        
+        if not message:
+            release(cur, conn)
+            return {
+                'statusCode': 404,
+                'headers': dict(JSON_HEADERS),
+                'body': json.dumps({'error': 'Message not found'})
+            }
+        
+        cur.execute(USER_REACTION_SQL, (message_id, user_id))
+        previous = cur.fetchone()
+        
+        if previous:
+            adjust_reaction(cur, message_id, previous[0], -1)
+            cur.execute(
+                "DELETE FROM message_reactions WHERE message_id = %s AND user_id = %s",
+                (message_id, user_id)
+            )
+        
+        # Sending the current emoji again (or an empty one) just removes the reaction
+        if emoji and (not previous or previous[0] != emoji):
+            adjust_reaction(cur, message_id, emoji, 1)
+            cur.execute(
+                "INSERT INTO message_reactions (message_id, user_id, emoji) VALUES (%s, %s, %s)",
+                (message_id, user_id, emoji)
+            )
+        
+        cur.execute("SELECT reactions FROM messages WHERE id = %s", (message_id,))
+        reactions = cur.fetchone()[0]
+        conn.commit()
+        release(cur, conn)
+        
+        return {
+            'statusCode': 200,
+            'headers': dict(JSON_HEADERS),
+            'body': json.dumps({'message_id': message_id, 'reactions': reactions}),
+            'isBase64Encoded': False
+        }
+    
     if method == 'DELETE':
         params = event.get('queryStringParameters', {}) if event.get('queryStringParameters') else {}
         body_data = json.loads(event.get('body', '{}')) if event.get('body') else {}
         message_id = params.get('message_id') or body_data.get('message_id')
-        user_id = params.get('user_id') or body_data.get('user_id')
         
-        if not message_id or not user_id:
-            cur.close()
-            conn.close()
+        if not message_id:
+            release(cur, conn)
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'message_id and user_id required'})
+                'headers': dict(JSON_HEADERS),
+                'body': json.dumps({'error': 'message_id required'})
             }
         
-        cur.execute(
-            "UPDATE messages SET removed_at = CURRENT_TIMESTAMP WHERE id = %s AND user_id = %s RETURNING id",
-            (message_id, user_id)
-        )
+        cur.execute(REMOVE_MESSAGE_SQL, (message_id, user_id))
         deleted = cur.fetchone()
         
         if not deleted:
-            cur.close()
-            conn.close()
+            release(cur, conn)
             return {
                 'statusCode': 404,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': dict(JSON_HEADERS),
                 'body': json.dumps({'error': 'Message not found or you are not the owner'})
             }
         
         conn.commit()
-        cur.close()
-        conn.close()
+        release(cur, conn)
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': dict(JSON_HEADERS),
             'body': json.dumps({'success': True, 'message_id': message_id}),
             'isBase64Encoded': False
         }
@@ -120,29 +435,29 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if method == 'POST':
         body_data = json.loads(event.get('body', '{}'))
         chat_id = body_data.get('chat_id')
-        user_id = body_data.get('user_id')
         content = body_data.get('content', '').strip()
         message_type = body_data.get('message_type', 'text')
         media_url = body_data.get('media_url')
         
-        if not chat_id or not user_id:
-            cur.close()
-            conn.close()
+        if not chat_id:
+            release(cur, conn)
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'chat_id and user_id required'})
+                'headers': dict(JSON_HEADERS),
+                'body': json.dumps({'error': 'chat_id required'})
             }
         
         if not content and not media_url:
-            cur.close()
-            conn.close()
+            release(cur, conn)
             return {
                 'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'headers': dict(JSON_HEADERS),
                 'body': json.dumps({'error': 'content or media_url required'})
             }
         
+        if not is_chat_member(cur, user_id, int(chat_id), use_denial_cache=False):
+            return forbidden(cur, conn)
+        
         cur.execute(
             "INSERT INTO messages (chat_id, user_id, content, message_type, media_url) VALUES (%s, %s, %s, %s, %s) RETURNING id, created_at",
             (chat_id, user_id, content or '', message_type, media_url)
@@ -156,8 +471,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         user = cur.fetchone()
         
         conn.commit()
-        cur.close()
-        conn.close()
+        release(cur, conn)
         
         result = {
             'id': message[0],
@@ -172,21 +486,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'display_name': user[2],
                 'avatar_color': user[3],
                 'avatar_url': user[4]
-            }
+            },
+            'reactions': {},
+            'seen_count': 0
         }
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': dict(JSON_HEADERS),
             'body': json.dumps(result),
             'isBase64Encoded': False
         }
     
-    cur.close()
-    conn.close()
+    release(cur, conn)
     
     return {
         'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'headers': dict(JSON_HEADERS),
         'body': json.dumps({'error': 'Method not allowed'})
     }
\ No newline at end of file
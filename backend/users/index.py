@@ -1,54 +1,193 @@
 '''
 Business: Search and get user information for starting private chats
-Args: event with httpMethod, queryStringParameters with search query
+Args: event with httpMethod, X-Auth-Token header, queryStringParameters with search query
 Returns: HTTP response with users list
 '''
 
 import json
 import os
-import psycopg2
-from typing import Dict, Any
+import time
+import hmac
+import base64
+import binascii
+import hashlib
+from typing import Dict, Any, Optional
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+PREFLIGHT_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': ''
+}
+
+# $n placeholders: runs only as execute_prepared(cur, 'user_search', ...)
+USER_SEARCH_SQL = """
+    SELECT id, username, display_name, avatar_color, avatar_url, bio, is_online, last_seen
+    FROM users
+    WHERE (username ILIKE $1 OR display_name ILIKE $2)
+    AND id != $3
+    ORDER BY is_online DESC, last_seen DESC
+    LIMIT 20
+"""
+
+# $n placeholders: runs only as execute_prepared(cur, 'user_list', ...)
+USER_LIST_SQL = """
+    SELECT id, username, display_name, avatar_color, avatar_url, bio, is_online, last_seen
+    FROM users
+    WHERE id != $1
+    ORDER BY is_online DESC, last_seen DESC
+    LIMIT 50
+"""
+
+# Every other *_SQL constant uses %s placeholders and goes through cur.execute()
+PREPARED_STATEMENTS = {
+    'user_search': ('text, text, integer', USER_SEARCH_SQL),
+    'user_list': ('integer', USER_LIST_SQL),
+}
+
+CONNECTION_PROBE_AFTER_SECONDS = 30
+
+_conn = None
+_conn_used_at = 0.0
+
+def get_connection():
+    '''
+    One connection per warm instance; psycopg2 is imported on the first request
+    that needs the database, so CORS preflights never pay for it. A connection
+    that sat idle (e.g. while the instance was frozen) is probed first, and one
+    the server or a NAT dropped is replaced within the same call.
+    '''
+    global _conn, _conn_used_at
+    import psycopg2
+    if _conn is not None and not _conn.closed:
+        try:
+            _conn.rollback()
+            if time.monotonic() - _conn_used_at > CONNECTION_PROBE_AFTER_SECONDS:
+                with _conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                _conn.rollback()
+        except psycopg2.Error:
+            _conn.close()
+    if _conn is None or _conn.closed:
+        _conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    _conn_used_at = time.monotonic()
+    return _conn
+
+def release(cur, conn) -> None:
+    cur.close()
+    conn.rollback()
+
+_prepared: Dict[str, Any] = {'conn': None, 'names': set()}
+
+def execute_prepared(cur, name: str, params: tuple) -> None:
+    '''
+    PREPAREs the statement once per connection and runs it with EXECUTE. A new
+    connection starts an empty registry; a statement lost by the server (26000)
+    or invalidated by a schema change (0A000) is re-prepared and retried once.
+    The retry rolls back the open transaction, so use it for reads only.
+    '''
+    import psycopg2
+    conn = cur.connection
+    if _prepared['conn'] is not conn:
+        _prepared['conn'] = conn
+        _prepared['names'] = set()
+    names = _prepared['names']
+    arg_types, sql = PREPARED_STATEMENTS[name]
+    placeholders = ', '.join(['%s'] * len(params))
+    for attempt in range(2):
+        try:
+            if name not in names:
+                cur.execute(f"PREPARE {name} ({arg_types}) AS {sql}")
+                names.add(name)
+            cur.execute(f"EXECUTE {name} ({placeholders})", params)
+            return
+        except psycopg2.Error as e:
+            if attempt or e.pgcode not in ('26000', '0A000'):
+                raise
+            conn.rollback()
+            cur.execute("DEALLOCATE ALL")
+            names.clear()
+
+DENY_LIST_TTL_SECONDS = 30
+
+DENY_LIST_SQL = "SELECT jti FROM revoked_tokens WHERE expires_at > CURRENT_TIMESTAMP"
+
+_deny_list: Dict[str, Any] = {'jtis': frozenset(), 'loaded_at': None}
+
+def b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def verify_access_token(token: str) -> Optional[Dict[str, Any]]:
+    try:
+        payload_part, signature_part = token.split('.')
+        signature = b64url_decode(signature_part)
+    except (ValueError, binascii.Error):
+        return None
+    expected = hmac.new(os.environ['TOKEN_SECRET'].encode(), payload_part.encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        return None
+    payload = json.loads(b64url_decode(payload_part))
+    if payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+def is_token_revoked(cur, jti: str) -> bool:
+    loaded_at = _deny_list['loaded_at']
+    if loaded_at is None or time.monotonic() - loaded_at > DENY_LIST_TTL_SECONDS:
+        cur.execute(DENY_LIST_SQL)
+        _deny_list['jtis'] = frozenset(row[0] for row in cur.fetchall())
+        _deny_list['loaded_at'] = time.monotonic()
+    return jti in _deny_list['jtis']
+
+def authenticate(event: Dict[str, Any], cur) -> Optional[int]:
+    '''
+    Signature and expiry are checked locally; the deny-list is refreshed at most
+    every DENY_LIST_TTL_SECONDS per warm instance.
+    '''
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    token = headers.get('x-auth-token')
+    if not token:
+        return None
+    payload = verify_access_token(token)
+    if not payload or is_token_revoked(cur, payload['jti']):
+        return None
+    return int(payload['sub'])
+
+def unauthorized(cur, conn) -> Dict[str, Any]:
+    release(cur, conn)
+    return {
+        'statusCode': 401,
+        'headers': dict(JSON_HEADERS),
+        'body': json.dumps({'error': 'Invalid or expired token'})
+    }
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return dict(PREFLIGHT_RESPONSE, headers=dict(PREFLIGHT_RESPONSE['headers']))
     
     if method == 'GET':
         params = event.get('queryStringParameters', {})
         search_query = params.get('search', '').strip()
-        current_user_id = params.get('user_id')
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         
+        current_user_id = authenticate(event, cur)
+        if not current_user_id:
+            return unauthorized(cur, conn)
+        
         if search_query:
-            cur.execute("""
-                SELECT id, username, display_name, avatar_color, avatar_url, bio, is_online, last_seen
-                FROM users
-                WHERE (username ILIKE %s OR display_name ILIKE %s)
-                AND id != %s
-                ORDER BY is_online DESC, last_seen DESC
-                LIMIT 20
-            """, (f'%{search_query}%', f'%{search_query}%', current_user_id or 0))
+            execute_prepared(cur, 'user_search', (f'%{search_query}%', f'%{search_query}%', current_user_id))
         else:
-            cur.execute("""
-                SELECT id, username, display_name, avatar_color, avatar_url, bio, is_online, last_seen
-                FROM users
-                WHERE id != %s
-                ORDER BY is_online DESC, last_seen DESC
-                LIMIT 50
-            """, (current_user_id or 0,))
+            execute_prepared(cur, 'user_list', (current_user_id,))
         
         users = []
         for row in cur.fetchall():
@@ -63,18 +202,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'last_seen': row[7].isoformat() if row[7] else None
             })
         
-        cur.close()
-        conn.close()
+        release(cur, conn)
         
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'headers': dict(JSON_HEADERS),
             'body': json.dumps(users),
             'isBase64Encoded': False
         }
     
     return {
         'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'headers': dict(JSON_HEADERS),
         'body': json.dumps({'error': 'Method not allowed'})
     }
@@ -0,0 +1,207 @@
+'''
+Business: Run deferred jobs from the Postgres queue and report queue metrics
+Args: event with httpMethod (POST runs the worker, GET returns queue stats) and X-Worker-Secret header
+Returns: HTTP response with run metrics or queue stats
+'''
+
+import json
+import os
+import time
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+PREFLIGHT_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-Worker-Secret',
+        'Access-Control-Max-Age': '86400'
+    },
+    'body': ''
+}
+
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', '4'))
+WORKER_BATCH_SIZE = int(os.environ.get('WORKER_BATCH_SIZE', '20'))
+WORKER_TIME_BUDGET_SECONDS = float(os.environ.get('WORKER_TIME_BUDGET_SECONDS', '20'))
+RETRY_BASE_DELAY_SECONDS = 5
+RETRY_MAX_DELAY_SECONDS = 3600
+JOB_RETENTION = '1 day'
+
+DEQUEUE_SQL = """
+    SELECT id, kind, payload, attempts, max_attempts,
+           EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - run_at))
+    FROM jobs
+    WHERE status = 'pending' AND run_at <= CURRENT_TIMESTAMP
+    ORDER BY run_at
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+# Jobs backing off have run_at in the future, so only due jobs count towards the oldest age
+QUEUE_STATS_SQL = """
+    SELECT status, COUNT(*),
+           EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - MIN(run_at) FILTER (WHERE run_at <= CURRENT_TIMESTAMP)))
+    FROM jobs
+    GROUP BY status
+"""
+
+def connect():
+    import psycopg2
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+def purge_expired_tokens(cur, payload: Dict[str, Any]) -> None:
+    cur.execute("DELETE FROM revoked_tokens WHERE expires_at < CURRENT_TIMESTAMP")
+    cur.execute("DELETE FROM refresh_tokens WHERE expires_at < CURRENT_TIMESTAMP")
+
+JOB_HANDLERS = {
+    'purge_expired_tokens': purge_expired_tokens,
+}
+
+def retry_delay(attempts: int) -> int:
+    return min(RETRY_BASE_DELAY_SECONDS * 2 ** (attempts - 1), RETRY_MAX_DELAY_SECONDS)
+
+def run_worker_loop(deadline: float) -> Dict[str, Any]:
+    '''
+    Dequeues batches with FOR UPDATE SKIP LOCKED until the queue is drained or the
+    deadline passes. Each batch is one transaction, so a crashed worker simply
+    releases its locks; each job runs in a savepoint so one failure does not undo
+    the rest of the batch.
+    '''
+    conn = connect()
+    cur = conn.cursor()
+    stats: Dict[str, Any] = {'done': 0, 'retried': 0, 'failed': 0, 'latencies': []}
+    
+    while time.monotonic() < deadline:
+        cur.execute(DEQUEUE_SQL, (WORKER_BATCH_SIZE,))
+        jobs = cur.fetchall()
+        if not jobs:
+            break
+        
+        done_ids = []
+        for job_id, kind, payload, attempts, max_attempts, waited in jobs:
+            stats['latencies'].append(float(waited))
+            cur.execute("SAVEPOINT job")
+            try:
+                JOB_HANDLERS[kind](cur, payload)
+                cur.execute("RELEASE SAVEPOINT job")
+                done_ids.append(job_id)
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT job")
+                attempts += 1
+                exhausted = attempts >= max_attempts
+                cur.execute(
+                    "UPDATE jobs SET attempts = %s, status = %s, last_error = %s, run_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second', finished_at = CASE WHEN %s THEN CURRENT_TIMESTAMP END WHERE id = %s",
+                    (attempts, 'failed' if exhausted else 'pending', repr(e), retry_delay(attempts), exhausted, job_id)
+                )
+                stats['failed' if exhausted else 'retried'] += 1
+        
+        if done_ids:
+            cur.execute(
+                "UPDATE jobs SET status = 'done', attempts = attempts + 1, finished_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)",
+                (done_ids,)
+            )
+            stats['done'] += len(done_ids)
+        conn.commit()
+    
+    cur.close()
+    conn.close()
+    return stats
+
+def run_worker() -> Dict[str, Any]:
+    started = time.monotonic()
+    deadline = started + WORKER_TIME_BUDGET_SECONDS
+    
+    with ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY) as pool:
+        results = list(pool.map(run_worker_loop, [deadline] * WORKER_CONCURRENCY))
+    
+    elapsed = time.monotonic() - started
+    latencies: List[float] = sorted(l for r in results for l in r['latencies'])
+    processed = sum(r['done'] + r['retried'] + r['failed'] for r in results)
+    
+    return {
+        'processed': processed,
+        'done': sum(r['done'] for r in results),
+        'retried': sum(r['retried'] for r in results),
+        'failed': sum(r['failed'] for r in results),
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_per_second': round(processed / elapsed, 2) if elapsed else 0,
+        'queue_latency_avg_seconds': round(sum(latencies) / len(latencies), 3) if latencies else 0,
+        'queue_latency_max_seconds': round(latencies[-1], 3) if latencies else 0,
+        'concurrency': WORKER_CONCURRENCY
+    }
+
+def queue_stats(cur) -> Dict[str, Any]:
+    cur.execute(QUEUE_STATS_SQL)
+    stats = {}
+    for status, count, oldest_age in cur.fetchall():
+        stats[status] = {'count': count}
+        if status == 'pending':
+            stats[status]['oldest_age_seconds'] = round(float(oldest_age), 3) if oldest_age is not None else 0
+    return stats
+
+def is_authorized(event: Dict[str, Any]) -> bool:
+    '''
+    The worker is driven by a scheduler, not the browser: every call must carry the
+    WORKER_SECRET shared secret, and nothing is accepted while it is unset.
+    '''
+    secret = os.environ.get('WORKER_SECRET', '')
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    return bool(secret) and hmac.compare_digest(headers.get('x-worker-secret', '').encode(), secret.encode())
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'POST')
+    
+    if method == 'OPTIONS':
+        return dict(PREFLIGHT_RESPONSE, headers=dict(PREFLIGHT_RESPONSE['headers']))
+    
+    if not is_authorized(event):
+        return {
+            'statusCode': 401,
+            'headers': dict(JSON_HEADERS),
+            'body': json.dumps({'error': 'Invalid worker secret'})
+        }
+    
+    if method == 'GET':
+        conn = connect()
+        cur = conn.cursor()
+        result = queue_stats(cur)
+        cur.close()
+        conn.close()
+        
+        return {
+            'statusCode': 200,
+            'headers': dict(JSON_HEADERS),
+            'body': json.dumps(result),
+            'isBase64Encoded': False
+        }
+    
+    if method == 'POST':
+        result = run_worker()
+        
+        conn = connect()
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM jobs WHERE status = 'done' AND finished_at < CURRENT_TIMESTAMP - %s::interval",
+            (JOB_RETENTION,)
+        )
+        conn.commit()
+        result['queue'] = queue_stats(cur)
+        cur.close()
+        conn.close()
+        
+        return {
+            'statusCode': 200,
+            'headers': dict(JSON_HEADERS),
+            'body': json.dumps(result),
+            'isBase64Encoded': False
+        }
+    
+    return {
+        'statusCode': 405,
+        'headers': dict(JSON_HEADERS),
+        'body': json.dumps({'error': 'Method not allowed'})
+    }
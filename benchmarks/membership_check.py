@@ -0,0 +1,47 @@
+'''
+Business: Measure what chat membership enforcement adds to the messages hot path
+Args: none; uses a stub cursor, so no database is needed
+Returns: prints ns per check and database round trips for each scenario
+'''
+
+import time
+
+from common import load_function
+
+ITERATIONS = 200_000
+CHATS_PER_USER = 50
+
+class StubCursor:
+    def __init__(self, chat_ids):
+        self.chat_ids = chat_ids
+        self.round_trips = 0
+    
+    def execute(self, query, params=None):
+        self.round_trips += 1
+    
+    def fetchall(self):
+        return [(chat_id,) for chat_id in self.chat_ids]
+
+def measure(label: str, check, cur: StubCursor, baseline_ns: float = 0.0) -> float:
+    cur.round_trips = 0
+    started = time.perf_counter_ns()
+    for _ in range(ITERATIONS):
+        check()
+    per_call = (time.perf_counter_ns() - started) / ITERATIONS
+    overhead = f'  (+{per_call - baseline_ns:.0f} ns vs no enforcement)' if baseline_ns else ''
+    print(f'{label:<44} {per_call:>8.0f} ns/check  {cur.round_trips:>7} round trips{overhead}')
+    return per_call
+
+def main() -> None:
+    messages = load_function('messages')
+    cur = StubCursor(range(1, CHATS_PER_USER + 1))
+    
+    baseline = measure('no enforcement', lambda: True, cur)
+    measure('member, warm cache', lambda: messages.is_chat_member(cur, 1, 7), cur, baseline)
+    measure('non-member, negative cache', lambda: messages.is_chat_member(cur, 1, 999), cur, baseline)
+    
+    messages.NON_MEMBER_TTL_SECONDS = 0
+    measure('non-member, negative cache disabled', lambda: messages.is_chat_member(cur, 1, 999), cur, baseline)
+
+if __name__ == '__main__':
+    main()
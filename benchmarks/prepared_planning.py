@@ -0,0 +1,63 @@
+'''
+Business: Planning time saved by running the chat list as a prepared statement
+Args: DATABASE_URL of a migrated database; optional user id argument (defaults to the member with most chats)
+Returns: prints median planning/execution time from EXPLAIN ANALYZE and client round trips, ad-hoc vs EXECUTE
+'''
+
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+from common import load_function
+
+RUNS = 50
+
+def explain_times(cur, query: str, params: tuple) -> tuple:
+    cur.execute(f"EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) {query}", params)
+    plan = cur.fetchone()[0][0]
+    return plan['Planning Time'], plan['Execution Time']
+
+def round_trip_ms(cur, query: str, params: tuple) -> float:
+    started = time.perf_counter()
+    cur.execute(query, params)
+    cur.fetchall()
+    return (time.perf_counter() - started) * 1000
+
+def report(label: str, samples: list) -> None:
+    planning = statistics.median(s[0] for s in samples)
+    execution = statistics.median(s[1] for s in samples)
+    round_trip = statistics.median(s[2] for s in samples)
+    print(f'{label:<12} planning {planning:>7.3f} ms  execution {execution:>7.3f} ms  round trip {round_trip:>7.3f} ms')
+
+def main() -> None:
+    chats = load_function('chats')
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    
+    if len(sys.argv) > 1:
+        user_id = int(sys.argv[1])
+    else:
+        cur.execute("SELECT user_id FROM chat_members GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+        user_id = cur.fetchone()[0]
+    
+    arg_types, prepared_sql = chats.PREPARED_STATEMENTS['chat_list']
+    ad_hoc_sql = prepared_sql.replace('$1', '%s')
+    cur.execute(f"PREPARE chat_list ({arg_types}) AS {prepared_sql}")
+    
+    ad_hoc, prepared = [], []
+    for _ in range(RUNS):
+        ad_hoc.append(explain_times(cur, ad_hoc_sql, (user_id,)) + (round_trip_ms(cur, ad_hoc_sql, (user_id,)),))
+        prepared.append(explain_times(cur, "EXECUTE chat_list (%s)", (user_id,)) + (round_trip_ms(cur, "EXECUTE chat_list (%s)", (user_id,)),))
+    
+    print(f'chat list for user {user_id}, median of {RUNS} runs')
+    report('ad-hoc', ad_hoc)
+    report('prepared', prepared)
+    cur.close()
+    conn.close()
+
+if __name__ == '__main__':
+    main()
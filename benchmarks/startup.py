@@ -0,0 +1,91 @@
+'''
+Business: Cold-start budget for every function in backend/
+Args: optional DATABASE_URL to also time the first authenticated request; BENCHMARK_USER_ID picks the caller
+Returns: prints import time, first OPTIONS latency and first request latency and status per function
+'''
+
+import json
+import os
+import subprocess
+import sys
+
+from common import function_names, load_function
+
+RUNS = 5
+BENCHMARK_USER_ID = int(os.environ.get('BENCHMARK_USER_ID', '1'))
+
+PROBE = '''
+import json, os, sys, time
+sys.path.insert(0, {benchmarks_dir!r})
+from common import load_function
+
+started = time.perf_counter()
+module = load_function({name!r})
+imported = time.perf_counter()
+module.handler({{'httpMethod': 'OPTIONS'}}, None)
+preflight = time.perf_counter()
+
+result = {{'import_ms': (imported - started) * 1000, 'options_ms': (preflight - imported) * 1000}}
+event = {event!r}
+if event:
+    try:
+        response = module.handler(json.loads(event), None)
+        result['first_request_ms'] = (time.perf_counter() - preflight) * 1000
+        result['status'] = response['statusCode']
+    except Exception as e:
+        result['first_request_error'] = repr(e)
+print(json.dumps(result))
+'''
+
+def first_request(name: str, cur) -> dict:
+    '''
+    The request a warm-up would serve first, authenticated as BENCHMARK_USER_ID so it
+    runs the token check, the hoisted SQL and the prepared statements, not an early 401.
+    '''
+    auth = load_function('auth')
+    headers = {'X-Auth-Token': auth.issue_access_token(BENCHMARK_USER_ID)}
+    if name == 'auth':
+        refresh_token = auth.issue_tokens(cur, BENCHMARK_USER_ID)['refresh_token']
+        cur.connection.commit()
+        return {'httpMethod': 'POST', 'headers': {}, 'body': json.dumps({'action': 'refresh', 'refresh_token': refresh_token})}
+    if name == 'messages':
+        cur.execute("SELECT chat_id FROM chat_members WHERE user_id = %s LIMIT 1", (BENCHMARK_USER_ID,))
+        return {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': {'chat_id': str(cur.fetchone()[0])}}
+    if name == 'worker':
+        return {'httpMethod': 'GET', 'headers': {'X-Worker-Secret': os.environ['WORKER_SECRET']}}
+    return {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': {}}
+
+def probe(name: str, cur) -> dict:
+    event = json.dumps(first_request(name, cur)) if cur else ''
+    code = PROBE.format(benchmarks_dir=os.path.dirname(os.path.abspath(__file__)), name=name, event=event)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else None
+
+def main() -> None:
+    # Probes inherit these, so the tokens and worker secret built here are accepted
+    os.environ.setdefault('TOKEN_SECRET', 'benchmark-secret')
+    os.environ.setdefault('WORKER_SECRET', 'benchmark-secret')
+    cur = None
+    if os.environ.get('DATABASE_URL'):
+        import psycopg2
+        cur = psycopg2.connect(os.environ['DATABASE_URL']).cursor()
+    
+    print(f'{"function":<10} {"import ms":>10} {"OPTIONS ms":>11} {"first request ms":>17} {"status":>7}')
+    for name in function_names():
+        runs = [probe(name, cur) for _ in range(RUNS)]
+        first_request_ms = median([r['first_request_ms'] for r in runs if 'first_request_ms' in r])
+        statuses = sorted({str(r['status']) for r in runs if 'status' in r})
+        errors = {r['first_request_error'] for r in runs if 'first_request_error' in r}
+        request_cell = f'{first_request_ms:>17.2f}' if first_request_ms is not None else f'{"-":>17}'
+        print(
+            f'{name:<10} {median([r["import_ms"] for r in runs]):>10.2f} '
+            f'{median([r["options_ms"] for r in runs]):>11.3f} {request_cell} {"/".join(statuses) or "-":>7}'
+            + (f'  {errors.pop()}' if errors else '')
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+-- Reaction counters live on the message itself (emoji -> count), so history reads need no join
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS reactions JSONB NOT NULL DEFAULT '{}';
+
+-- Who reacted with what; only touched when a reaction changes, never when reading history
+CREATE TABLE IF NOT EXISTS message_reactions (
+    message_id INTEGER REFERENCES messages(id),
+    user_id INTEGER REFERENCES users(id),
+    emoji VARCHAR(16) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (message_id, user_id)
+);
+
+-- Read receipts: highest message id each member has seen in the chat
+ALTER TABLE chat_members ADD COLUMN IF NOT EXISTS last_read_message_id INTEGER NOT NULL DEFAULT 0;
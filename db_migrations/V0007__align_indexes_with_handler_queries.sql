@@ -0,0 +1,24 @@
+-- History and the chat list's last-message lookups filter by chat, skip removed
+-- messages and order by created_at; one partial composite index serves both
+-- (forward scan for history, backward scan for LIMIT 1 last message)
+CREATE INDEX IF NOT EXISTS idx_messages_chat_created_live ON messages(chat_id, created_at) WHERE removed_at IS NULL;
+DROP INDEX IF EXISTS idx_messages_chat_id;
+DROP INDEX IF EXISTS idx_messages_created_at;
+
+-- Chat list, membership cache loads and private chat lookups go by user_id;
+-- covering chat_id and unread_count allows index-only scans
+CREATE INDEX IF NOT EXISTS idx_chat_members_user_chat ON chat_members(user_id, chat_id) INCLUDE (unread_count);
+DROP INDEX IF EXISTS idx_chat_members_user_id;
+
+-- Read watermarks are loaded per chat; UNIQUE(chat_id, user_id) already covers plain chat_id lookups
+CREATE INDEX IF NOT EXISTS idx_chat_members_chat_watermark ON chat_members(chat_id) INCLUDE (user_id, last_read_message_id);
+DROP INDEX IF EXISTS idx_chat_members_chat_id;
+
+-- type has three values and is never the selective predicate
+DROP INDEX IF EXISTS idx_chats_type;
+
+-- Public chat search returns the newest channels and groups first
+CREATE INDEX IF NOT EXISTS idx_chats_public_created_at ON chats(created_at DESC) WHERE type IN ('channel', 'group');
+
+-- User list is ordered by presence, then recency, with a LIMIT
+CREATE INDEX IF NOT EXISTS idx_users_online_last_seen ON users(is_online DESC, last_seen DESC);
@@ -0,0 +1,4 @@
+-- History is paged by message id (before_id keyset) and the chat list's last-message
+-- lookups take the highest id; ids follow insert order, so one index serves both
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_live ON messages(chat_id, id) WHERE removed_at IS NULL;
+DROP INDEX IF EXISTS idx_messages_chat_created_live;
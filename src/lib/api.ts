@@ -0,0 +1,82 @@
+export const API = {
+  auth: 'https://functions.poehali.dev/1fdd0be6-6d60-4bdd-8af2-1f0f6c40c21f',
+  chats: 'https://functions.poehali.dev/1ff51085-bf88-4077-bab1-4abdf05a3922',
+  messages: 'https://functions.poehali.dev/25f6ac70-2049-4f7d-ba39-2691a2f2b7ab',
+  users: 'https://functions.poehali.dev/a87a4587-2fd5-4ba2-8416-35724f536cf2',
+};
+
+const SESSION_KEY = 'duwdu_session';
+
+interface Session {
+  access_token: string;
+  refresh_token: string;
+}
+
+export const getSession = (): Session | null => {
+  const saved = localStorage.getItem(SESSION_KEY);
+  return saved ? JSON.parse(saved) : null;
+};
+
+export const saveSession = (session: Session) => {
+  localStorage.setItem(
+    SESSION_KEY,
+    JSON.stringify({ access_token: session.access_token, refresh_token: session.refresh_token })
+  );
+};
+
+export const clearSession = () => {
+  localStorage.removeItem(SESSION_KEY);
+};
+
+let pendingRefresh: Promise<boolean> | null = null;
+let sessionExpiredHandler: (() => void) | null = null;
+
+// Called once a refresh fails and the session is gone, so the UI can return to login
+export const onSessionExpired = (handler: (() => void) | null) => {
+  sessionExpiredHandler = handler;
+};
+
+const expireSession = () => {
+  clearSession();
+  sessionExpiredHandler?.();
+  return false;
+};
+
+// Refresh tokens rotate on use, so concurrent 401s must share a single refresh
+const refreshSession = (): Promise<boolean> => {
+  if (pendingRefresh) return pendingRefresh;
+
+  pendingRefresh = (async () => {
+    const session = getSession();
+    if (!session) return expireSession();
+
+    const response = await fetch(API.auth, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'refresh', refresh_token: session.refresh_token }),
+    });
+
+    if (!response.ok) return expireSession();
+
+    saveSession(await response.json());
+    return true;
+  })().finally(() => {
+    pendingRefresh = null;
+  });
+
+  return pendingRefresh;
+};
+
+export const authFetch = async (url: string, init: RequestInit = {}): Promise<Response> => {
+  const send = () =>
+    fetch(url, {
+      ...init,
+      headers: { ...init.headers, 'X-Auth-Token': getSession()?.access_token || '' },
+    });
+
+  const response = await send();
+  if (response.status === 401 && (await refreshSession())) {
+    return send();
+  }
+  return response;
+};
@@ -11,13 +11,7 @@ import { ScrollArea } from '@/components/ui/scroll-area';
 import { toast } from 'sonner';
 import { STICKER_PACKS } from '@/lib/stickers';
 import { uploadImage, startAudioRecording } from '@/lib/media';
-
-const API = {
-  auth: 'https://functions.poehali.dev/1fdd0be6-6d60-4bdd-8af2-1f0f6c40c21f',
-  chats: 'https://functions.poehali.dev/1ff51085-bf88-4077-bab1-4abdf05a3922',
-  messages: 'https://functions.poehali.dev/25f6ac70-2049-4f7d-ba39-2691a2f2b7ab',
-  users: 'https://functions.poehali.dev/a87a4587-2fd5-4ba2-8416-35724f536cf2',
-};
+import { API, authFetch, getSession, onSessionExpired, saveSession } from '@/lib/api';
 
 interface User {
   id: number;
@@ -50,13 +44,21 @@ interface Message {
   created_at: string;
   media_url?: string;
   user: User;
+  reactions?: Record<string, number>;
+  seen_count?: number;
 }
 
+const QUICK_REACTIONS = ['👍', '❤️', '😂', '🔥'];
+
+// Must match HISTORY_LIMIT in backend/messages/index.py
+const HISTORY_PAGE_SIZE = 200;
+
 export default function Index() {
   const [user, setUser] = useState<User | null>(null);
   const [chats, setChats] = useState<Chat[]>([]);
   const [selectedChat, setSelectedChat] = useState<Chat | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  const [reachedHistoryStart, setReachedHistoryStart] = useState(false);
   const [messageInput, setMessageInput] = useState('');
   const [username, setUsername] = useState('');
   const [password, setPassword] = useState('');
@@ -90,9 +92,11 @@ export default function Index() {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
+  const lastMessageId = messages[messages.length - 1]?.id;
+
   useEffect(() => {
     scrollToBottom();
-  }, [messages]);
+  }, [lastMessageId]);
 
   useEffect(() => {
     if (user) {
@@ -102,6 +106,8 @@ export default function Index() {
 
   useEffect(() => {
     if (selectedChat) {
+      setMessages([]);
+      setReachedHistoryStart(false);
       loadMessages();
       setShowMobileSidebar(false);
       const interval = setInterval(loadMessages, 2000);
@@ -111,11 +117,23 @@ export default function Index() {
 
   useEffect(() => {
     const savedUser = localStorage.getItem('duwdu_user');
-    if (savedUser) {
+    if (savedUser && getSession()) {
       setUser(JSON.parse(savedUser));
     }
   }, []);
 
+  useEffect(() => {
+    onSessionExpired(() => {
+      localStorage.removeItem('duwdu_user');
+      setUser(null);
+      setSelectedChat(null);
+      setChats([]);
+      setMessages([]);
+      toast.error('Сессия истекла, войдите снова');
+    });
+    return () => onSessionExpired(null);
+  }, []);
+
   const handleAuth = async () => {
     if (!username.trim() || !password.trim()) {
       toast.error('Заполните все поля');
@@ -146,8 +164,10 @@ export default function Index() {
         return;
       }
 
-      setUser(data);
-      localStorage.setItem('duwdu_user', JSON.stringify(data));
+      const { access_token, refresh_token, expires_in, ...profile } = data;
+      saveSession({ access_token, refresh_token });
+      setUser(profile);
+      localStorage.setItem('duwdu_user', JSON.stringify(profile));
       toast.success(isRegister ? 'Регистрация успешна!' : `Добро пожаловать, ${data.display_name}!`);
     } catch (error) {
       toast.error('Ошибка соединения');
@@ -158,7 +178,8 @@ export default function Index() {
     if (!user) return;
 
     try {
-      const response = await fetch(`${API.chats}?user_id=${user.id}`);
+      const response = await authFetch(API.chats);
+      if (!response.ok) return;
       const data = await response.json();
       setChats(data);
 
@@ -171,35 +192,56 @@ export default function Index() {
   };
 
   const loadMessages = async () => {
-    if (!selectedChat) return;
+    if (!selectedChat || !user) return;
 
     try {
-      const response = await fetch(`${API.messages}?chat_id=${selectedChat.id}`);
-      const data = await response.json();
-      setMessages(data);
+      const response = await authFetch(`${API.messages}?chat_id=${selectedChat.id}`);
+      if (!response.ok) return;
+      const data: Message[] = await response.json();
+      // The poll returns the newest page; keep any older pages already loaded above it
+      setMessages((prev) => (data.length ? [...prev.filter((msg) => msg.id < data[0].id), ...data] : []));
     } catch (error) {
       console.error('Ошибка загрузки сообщений', error);
     }
   };
 
+  const loadOlderMessages = async () => {
+    if (!selectedChat || !user || messages.length === 0) return;
+
+    try {
+      const response = await authFetch(`${API.messages}?chat_id=${selectedChat.id}&before_id=${messages[0].id}`);
+      if (!response.ok) return;
+      const data: Message[] = await response.json();
+      setMessages((prev) => [...data, ...prev.filter((msg) => !data.length || msg.id > data[data.length - 1].id)]);
+      setReachedHistoryStart(data.length < HISTORY_PAGE_SIZE);
+    } catch (error) {
+      toast.error('Ошибка загрузки сообщений');
+    }
+  };
+
   const sendMessage = async (content?: string, messageType: string = 'text', mediaUrl?: string) => {
     const textContent = content || messageInput.trim();
     if (!textContent && !mediaUrl) return;
     if (!user || !selectedChat) return;
 
     try {
-      const response = await fetch(API.messages, {
+      const response = await authFetch(API.messages, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           chat_id: selectedChat.id,
-          user_id: user.id,
           content: textContent,
           message_type: messageType,
           media_url: mediaUrl,
         }),
       });
 
+      if (!response.ok) {
+        const error = await response.json();
+        toast.error(error.error || 'Ошибка отправки');
+        return;
+      }
+
       const newMessage = await response.json();
       setMessages([...messages, newMessage]);
       setMessageInput('');
@@ -226,13 +268,12 @@ export default function Index() {
     }
 
     try {
-      const response = await fetch(API.chats, {
+      const response = await authFetch(API.chats, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           name: newChatName.trim(),
           type: newChatType,
-          user_id: user.id,
           username: newChatUsername.trim() || undefined,
         }),
       });
@@ -258,7 +299,8 @@ export default function Index() {
     if (!user) return;
 
     try {
-      const response = await fetch(`${API.users}?search=${searchUsers}&user_id=${user.id}`);
+      const response = await authFetch(`${API.users}?search=${searchUsers}`);
+      if (!response.ok) return;
       const data = await response.json();
       setFoundUsers(data);
     } catch (error) {
@@ -268,7 +310,8 @@ export default function Index() {
 
   const searchForChats = async () => {
     try {
-      const response = await fetch(`${API.chats}?search=${searchChats}`);
+      const response = await authFetch(`${API.chats}?search=${searchChats}`);
+      if (!response.ok) return;
       const data = await response.json();
       setFoundChats(data);
     } catch (error) {
@@ -298,12 +341,11 @@ export default function Index() {
     if (!user) return;
 
     try {
-      const response = await fetch(API.chats, {
+      const response = await authFetch(API.chats, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           type: 'private',
-          user_id: user.id,
           other_user_id: otherUser.id,
         }),
       });
@@ -322,11 +364,29 @@ export default function Index() {
   const joinChat = async (chat: Chat) => {
     if (!user) return;
 
-    loadChats();
-    setSelectedChat(chat);
-    setIsSearchOpen(false);
-    setSearchChats('');
-    toast.success(`Открыт ${chat.name}`);
+    try {
+      const response = await authFetch(API.chats, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          action: 'join',
+          chat_id: chat.id,
+        }),
+      });
+
+      if (!response.ok) {
+        toast.error('Ошибка вступления в чат');
+        return;
+      }
+
+      loadChats();
+      setSelectedChat(chat);
+      setIsSearchOpen(false);
+      setSearchChats('');
+      toast.success(`Открыт ${chat.name}`);
+    } catch (error) {
+      toast.error('Ошибка соединения');
+    }
   };
 
   const handleAvatarFileChange = (e: React.ChangeEvent<HTMLInputElement>) => {
@@ -364,11 +424,10 @@ export default function Index() {
     avatarUrl = avatarUrl || user.avatar_url || null;
 
     try {
-      const response = await fetch(API.auth, {
+      const response = await authFetch(API.auth, {
         method: 'PUT',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
-          user_id: user.id,
           avatar_url: avatarUrl,
         }),
       });
@@ -396,12 +455,11 @@ export default function Index() {
     const avatar_url = chatAvatarPreview || selectedChat.avatar_url || null;
 
     try {
-      const response = await fetch(API.chats, {
+      const response = await authFetch(API.chats, {
         method: 'PUT',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           chat_id: selectedChat.id,
-          user_id: user.id,
           avatar_url: avatar_url,
         }),
       });
@@ -486,12 +544,11 @@ export default function Index() {
     if (!user) return;
 
     try {
-      const response = await fetch(API.messages, {
+      const response = await authFetch(API.messages, {
         method: 'DELETE',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           message_id: messageId,
-          user_id: user.id,
         }),
       });
 
@@ -506,6 +563,33 @@ export default function Index() {
     }
   };
 
+  const reactToMessage = async (messageId: number, emoji: string) => {
+    if (!user) return;
+
+    try {
+      const response = await authFetch(API.messages, {
+        method: 'PUT',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          message_id: messageId,
+          emoji,
+        }),
+      });
+
+      if (!response.ok) {
+        toast.error('Не удалось поставить реакцию');
+        return;
+      }
+
+      const data = await response.json();
+      setMessages((current) =>
+        current.map((m) => (m.id === messageId ? { ...m, reactions: data.reactions } : m))
+      );
+    } catch (error) {
+      toast.error('Ошибка соединения');
+    }
+  };
+
   const getChatTitle = (chat: Chat) => {
     if (chat.type === 'private' && chat.other_user) {
       return chat.other_user.display_name;
@@ -1050,6 +1134,13 @@ export default function Index() {
 
             <ScrollArea className="flex-1 p-4">
               <div className="space-y-4">
+                {messages.length >= HISTORY_PAGE_SIZE && !reachedHistoryStart && (
+                  <div className="flex justify-center">
+                    <Button variant="ghost" size="sm" onClick={loadOlderMessages}>
+                      Загрузить ранние сообщения
+                    </Button>
+                  </div>
+                )}
                 {messages.map((msg) => (
                   <div
                     key={msg.id}
@@ -1110,12 +1201,39 @@ export default function Index() {
                             <Icon name="Trash2" size={16} />
                           </Button>
                         )}
+                        <div className="flex gap-1 mt-1 opacity-0 group-hover:opacity-100 transition-opacity">
+                          {QUICK_REACTIONS.map((emoji) => (
+                            <button
+                              key={emoji}
+                              className="text-sm hover:scale-125 transition-transform"
+                              onClick={() => reactToMessage(msg.id, emoji)}
+                            >
+                              {emoji}
+                            </button>
+                          ))}
+                        </div>
                       </div>
-                      <div className="text-xs text-muted-foreground mt-1 px-1">
+                      {msg.reactions && Object.keys(msg.reactions).length > 0 && (
+                        <div className="flex flex-wrap gap-1 mt-1">
+                          {Object.entries(msg.reactions).map(([emoji, count]) => (
+                            <button
+                              key={emoji}
+                              className="text-xs px-2 py-0.5 rounded-full bg-secondary hover:bg-secondary/80"
+                              onClick={() => reactToMessage(msg.id, emoji)}
+                            >
+                              {emoji} {count}
+                            </button>
+                          ))}
+                        </div>
+                      )}
+                      <div className="text-xs text-muted-foreground mt-1 px-1 flex items-center gap-1">
                         {new Date(msg.created_at).toLocaleTimeString('ru-RU', {
                           hour: '2-digit',
                           minute: '2-digit',
                         })}
+                        {msg.user.id === user.id && (
+                          <Icon name={msg.seen_count ? 'CheckCheck' : 'Check'} size={14} />
+                        )}
                       </div>
                     </div>
                   </div>
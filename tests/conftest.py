@@ -0,0 +1,67 @@
+import importlib.util
+import os
+import re
+import sys
+from types import ModuleType
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+
+def load_function(name: str) -> ModuleType:
+    spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(BACKEND_DIR, name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules.pop(spec.name, None)
+    spec.loader.exec_module(module)
+    return module
+
+class ScriptedCursor:
+    '''
+    Answers each query with the rows of the first (pattern, rows) rule whose regex
+    matches it, and records every statement for assertions.
+    '''
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self.executed = []
+        self.rows = []
+        self.connection = None
+    
+    def execute(self, query, params=None):
+        self.executed.append((' '.join(query.split()), params))
+        self.rows = []
+        for pattern, rows in self.rules:
+            if re.search(pattern, query, re.S):
+                self.rows = list(rows(params) if callable(rows) else rows)
+                break
+    
+    def fetchall(self):
+        return self.rows
+    
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+    
+    def close(self):
+        pass
+    
+    def queries(self, pattern):
+        return [q for q, _ in self.executed if re.search(pattern, q)]
+
+class StubConnection:
+    def __init__(self, cursor: ScriptedCursor):
+        self.cur = cursor
+        cursor.connection = self
+        self.commits = 0
+    
+    def cursor(self):
+        return self.cur
+    
+    def commit(self):
+        self.commits += 1
+    
+    def rollback(self):
+        pass
+
+@pytest.fixture
+def token_secret(monkeypatch):
+    monkeypatch.setenv('TOKEN_SECRET', 'test-secret')
+    return 'test-secret'
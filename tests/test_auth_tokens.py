@@ -0,0 +1,169 @@
+import json
+import datetime
+import glob
+import os
+import urllib.parse
+
+import pytest
+
+from conftest import BACKEND_DIR, ScriptedCursor, StubConnection, load_function
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(BACKEND_DIR), 'db_migrations')
+
+def call(module, event, cur, monkeypatch):
+    conn = StubConnection(cur)
+    monkeypatch.setattr(module, 'get_connection', lambda: conn)
+    return module.handler(event, None)
+
+def test_token_round_trip_across_functions(token_secret):
+    token = load_function('auth').issue_access_token(42)
+    
+    for name in ('chats', 'messages', 'users'):
+        payload = load_function(name).verify_access_token(token)
+        assert payload['sub'] == 42
+
+def test_tampered_token_is_rejected(token_secret):
+    auth = load_function('auth')
+    users = load_function('users')
+    payload_part, signature_part = auth.issue_access_token(42).split('.')
+    forged_payload = auth.b64url_encode(json.dumps({'sub': 1, 'jti': 'x', 'exp': 2 ** 31}).encode())
+    
+    assert users.verify_access_token(f'{forged_payload}.{signature_part}') is None
+    assert users.verify_access_token(f'{payload_part}.{signature_part[:-2]}AA') is None
+    assert users.verify_access_token('not-a-token') is None
+
+def test_expired_token_is_rejected(token_secret):
+    auth = load_function('auth')
+    auth.ACCESS_TOKEN_TTL_SECONDS = -1
+    
+    assert load_function('users').verify_access_token(auth.issue_access_token(42)) is None
+
+def test_token_signed_with_another_secret_is_rejected(token_secret, monkeypatch):
+    token = load_function('auth').issue_access_token(42)
+    monkeypatch.setenv('TOKEN_SECRET', 'rotated')
+    
+    assert load_function('users').verify_access_token(token) is None
+
+def test_revoked_token_is_rejected(token_secret):
+    auth = load_function('auth')
+    users = load_function('users')
+    token = auth.issue_access_token(42)
+    jti = users.verify_access_token(token)['jti']
+    cur = ScriptedCursor([(r'FROM revoked_tokens', [(jti,)])])
+    
+    assert users.authenticate({'headers': {'X-Auth-Token': token}}, cur) is None
+
+def test_request_without_token_gets_401(token_secret, monkeypatch):
+    users = load_function('users')
+    response = call(users, {'httpMethod': 'GET', 'queryStringParameters': {'search': 'test'}}, ScriptedCursor(), monkeypatch)
+    
+    assert response['statusCode'] == 401
+
+def test_user_search_with_token(token_secret, monkeypatch):
+    token = load_function('auth').issue_access_token(42)
+    users = load_function('users')
+    seen = datetime.datetime(2026, 1, 1)
+    cur = ScriptedCursor([
+        (r'EXECUTE user_search', [(7, 'testuser', 'Test User', '#0088cc', None, None, True, seen)]),
+    ])
+    event = {'httpMethod': 'GET', 'headers': {'x-auth-token': token}, 'queryStringParameters': {'search': 'test'}}
+    
+    response = call(users, event, cur, monkeypatch)
+    
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])[0]['username'] == 'testuser'
+    assert cur.executed[-1][1] == ('%test%', '%test%', 42)
+
+def test_chat_list_uses_token_user(token_secret, monkeypatch):
+    token = load_function('auth').issue_access_token(42)
+    chats = load_function('chats')
+    created = datetime.datetime(2026, 1, 1)
+    cur = ScriptedCursor([
+        (r'EXECUTE chat_list', [(1, 'Общий чат', 'group', created, None, None, 'hi', created, 'text', 0)]),
+    ])
+    event = {'httpMethod': 'GET', 'headers': {'X-Auth-Token': token}, 'queryStringParameters': {}}
+    
+    response = call(chats, event, cur, monkeypatch)
+    
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])[0]['last_message'] == 'hi'
+    assert cur.executed[-1][1] == (42,)
+
+def test_send_message_with_token(token_secret, monkeypatch):
+    token = load_function('auth').issue_access_token(42)
+    messages = load_function('messages')
+    created = datetime.datetime(2026, 1, 1)
+    cur = ScriptedCursor([
+        (r'FROM chat_members WHERE user_id', [(1,)]),
+        (r'INSERT INTO messages', [(100, created)]),
+        (r'FROM users WHERE id', [(42, 'testuser', 'Test User', '#0088cc', None)]),
+    ])
+    event = {
+        'httpMethod': 'POST',
+        'headers': {'X-Auth-Token': token},
+        'body': json.dumps({'chat_id': 1, 'content': 'Hello!', 'message_type': 'text'})
+    }
+    
+    response = call(messages, event, cur, monkeypatch)
+    
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['user']['id'] == 42
+    insert_params = next(params for query, params in cur.executed if query.startswith('INSERT INTO messages'))
+    assert insert_params[1] == 42
+
+def register(auth, monkeypatch, conn=None):
+    if conn:
+        monkeypatch.setattr(auth, 'get_connection', lambda: conn)
+    body = {'action': 'register', 'username': 'newbie', 'password': 'secret', 'display_name': 'Newbie'}
+    return auth.handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+
+def test_registration_joins_the_general_chat_inline(token_secret, monkeypatch):
+    auth = load_function('auth')
+    cur = ScriptedCursor([
+        (r'SELECT id FROM users WHERE username', []),
+        (r'INSERT INTO users', [(7, 'newbie', 'Newbie', '#0088cc', None, None)]),
+    ])
+    conn = StubConnection(cur)
+    
+    response = register(auth, monkeypatch, conn)
+    
+    assert response['statusCode'] == 200
+    assert cur.queries(r"INSERT INTO chat_members .* FROM chats WHERE name = 'Общий чат' AND created_by IS NULL .* LIMIT 1")
+    assert not cur.queries('INSERT INTO jobs')
+    assert conn.commits == 1
+
+@pytest.fixture
+def schema_url():
+    if not os.environ.get('DATABASE_URL'):
+        pytest.skip('DATABASE_URL is not set')
+    psycopg2 = pytest.importorskip('psycopg2')
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("DROP SCHEMA IF EXISTS auth_test CASCADE")
+    cur.execute("CREATE SCHEMA auth_test")
+    cur.execute("SET search_path TO auth_test")
+    for migration in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, 'V*.sql'))):
+        cur.execute(open(migration, encoding='utf-8').read())
+    separator = '&' if '?' in os.environ['DATABASE_URL'] else '?'
+    yield os.environ['DATABASE_URL'] + separator + 'options=' + urllib.parse.quote('-csearch_path=auth_test'), cur
+    cur.execute("DROP SCHEMA auth_test CASCADE")
+    conn.close()
+
+def test_registration_ignores_user_chats_named_like_the_general_chat(schema_url, token_secret, monkeypatch):
+    url, cur = schema_url
+    cur.execute("INSERT INTO users (username, display_name, password_hash) VALUES ('squatter', 'Squatter', 'x') RETURNING id")
+    squatter_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO chats (name, type, created_by) VALUES ('Общий чат', 'channel', %s)", (squatter_id,))
+    monkeypatch.setenv('DATABASE_URL', url)
+    auth = load_function('auth')
+    
+    response = register(auth, monkeypatch)
+    auth.get_connection().close()
+    
+    cur.execute(
+        "SELECT c.created_by FROM chat_members cm JOIN chats c ON c.id = cm.chat_id WHERE cm.user_id = %s",
+        (json.loads(response['body'])['id'],)
+    )
+    assert response['statusCode'] == 200
+    assert cur.fetchall() == [(None,)]
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from conftest import load_function
+
+FUNCTIONS = ('auth', 'chats', 'messages', 'users')
+
+@pytest.mark.parametrize('name', FUNCTIONS)
+def test_preflight_response_is_not_shared_between_invocations(name):
+    module = load_function(name)
+    first = module.handler({'httpMethod': 'OPTIONS'}, None)
+    first['headers']['X-Leak'] = '1'
+    first['statusCode'] = 500
+    
+    second = module.handler({'httpMethod': 'OPTIONS'}, None)
+    
+    assert 'X-Leak' not in second['headers']
+    assert second['statusCode'] == 200
+    assert 'X-Leak' not in module.PREFLIGHT_RESPONSE['headers']
+
+@pytest.mark.skipif(not os.environ.get('DATABASE_URL'), reason='DATABASE_URL is not set')
+@pytest.mark.parametrize('name', FUNCTIONS)
+def test_dropped_connection_is_replaced_in_the_same_call(name):
+    psycopg2 = pytest.importorskip('psycopg2')
+    module = load_function(name)
+    conn = module.get_connection()
+    
+    killer = psycopg2.connect(os.environ['DATABASE_URL'])
+    killer.autocommit = True
+    with killer.cursor() as cur:
+        cur.execute("SELECT pg_terminate_backend(%s)", (conn.get_backend_pid(),))
+    killer.close()
+    module._conn_used_at -= module.CONNECTION_PROBE_AFTER_SECONDS + 1
+    
+    fresh = module.get_connection()
+    
+    assert fresh is not conn
+    with fresh.cursor() as cur:
+        cur.execute("SELECT 1")
+        assert cur.fetchone() == (1,)
+    fresh.close()
@@ -0,0 +1,55 @@
+import datetime
+import json
+
+from conftest import ScriptedCursor, StubConnection, load_function
+
+CREATED = datetime.datetime(2026, 1, 1)
+
+def membership_cursor(chat_ids):
+    return ScriptedCursor([(r'FROM chat_members WHERE user_id', lambda params: [(c,) for c in chat_ids])])
+
+def test_member_check_is_served_from_cache():
+    messages = load_function('messages')
+    cur = membership_cursor([1, 2, 3])
+    
+    assert messages.is_chat_member(cur, 10, 2)
+    assert messages.is_chat_member(cur, 10, 3)
+    assert len(cur.queries('chat_members')) == 1
+
+def test_non_member_denial_is_cached():
+    messages = load_function('messages')
+    cur = membership_cursor([1])
+    
+    assert not messages.is_chat_member(cur, 10, 5)
+    assert not messages.is_chat_member(cur, 10, 5)
+    assert len(cur.queries('chat_members')) == 1
+
+def test_new_membership_is_picked_up_after_denial_expires():
+    messages = load_function('messages')
+    chat_ids = [1]
+    cur = membership_cursor(chat_ids)
+    
+    assert not messages.is_chat_member(cur, 10, 5)
+    chat_ids.append(5)
+    messages._non_member_cache[(10, 5)] -= messages.NON_MEMBER_TTL_SECONDS
+    
+    assert messages.is_chat_member(cur, 10, 5)
+    assert (10, 5) not in messages._non_member_cache
+
+def test_send_right_after_join_ignores_cached_denial(token_secret, monkeypatch):
+    messages = load_function('messages')
+    chat_ids = [1]
+    cur = ScriptedCursor([
+        (r'FROM chat_members WHERE user_id', lambda params: [(c,) for c in chat_ids]),
+        (r'INSERT INTO messages', [(20, CREATED)]),
+        (r'FROM users WHERE id', [(10, 'me', 'Me', '#0088cc', None)]),
+    ])
+    monkeypatch.setattr(messages, 'get_connection', lambda: StubConnection(cur))
+    headers = {'X-Auth-Token': load_function('auth').issue_access_token(10)}
+    
+    poll = messages.handler({'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': {'chat_id': '5'}}, None)
+    chat_ids.append(5)
+    send = messages.handler({'httpMethod': 'POST', 'headers': headers, 'body': json.dumps({'chat_id': 5, 'content': 'hi'})}, None)
+    
+    assert poll['statusCode'] == 403
+    assert send['statusCode'] == 200
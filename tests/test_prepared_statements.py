@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from conftest import ScriptedCursor, StubConnection, load_function
+
+def test_statement_is_prepared_once_per_connection():
+    users = load_function('users')
+    cur = ScriptedCursor()
+    StubConnection(cur)
+    
+    users.execute_prepared(cur, 'user_list', (1,))
+    users.execute_prepared(cur, 'user_list', (2,))
+    
+    assert len(cur.queries(r'^PREPARE user_list')) == 1
+    assert len(cur.queries(r'^EXECUTE user_list')) == 2
+
+def test_new_connection_starts_an_empty_registry():
+    users = load_function('users')
+    first = ScriptedCursor()
+    StubConnection(first)
+    second = ScriptedCursor()
+    StubConnection(second)
+    
+    users.execute_prepared(first, 'user_list', (1,))
+    users.execute_prepared(second, 'user_list', (1,))
+    
+    assert len(second.queries(r'^PREPARE user_list')) == 1
+
+@pytest.mark.skipif(not os.environ.get('DATABASE_URL'), reason='DATABASE_URL is not set')
+def test_statement_dropped_on_the_server_is_prepared_again():
+    psycopg2 = pytest.importorskip('psycopg2')
+    users = load_function('users')
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute("CREATE TEMP TABLE users (id INTEGER, username TEXT, display_name TEXT, avatar_color TEXT, avatar_url TEXT, bio TEXT, is_online BOOLEAN, last_seen TIMESTAMP)")
+    cur.execute("INSERT INTO users (id, username) VALUES (1, 'a'), (2, 'b')")
+    conn.commit()
+    
+    users.execute_prepared(cur, 'user_list', (1,))
+    assert [row[1] for row in cur.fetchall()] == ['b']
+    
+    cur.execute("DEALLOCATE ALL")
+    users.execute_prepared(cur, 'user_list', (2,))
+    assert [row[1] for row in cur.fetchall()] == ['a']
+    conn.close()
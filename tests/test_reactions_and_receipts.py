@@ -0,0 +1,121 @@
+import datetime
+import json
+import os
+
+import pytest
+
+from conftest import ScriptedCursor, StubConnection, load_function
+
+CREATED = datetime.datetime(2026, 1, 1)
+
+def call(module, method, token, cur, monkeypatch, body=None, params=None):
+    conn = StubConnection(cur)
+    monkeypatch.setattr(module, 'get_connection', lambda: conn)
+    event = {'httpMethod': method, 'headers': {'X-Auth-Token': token}, 'queryStringParameters': params or {}}
+    if body is not None:
+        event['body'] = json.dumps(body)
+    return module.handler(event, None), conn
+
+@pytest.fixture
+def token(token_secret):
+    return load_function('auth').issue_access_token(1)
+
+@pytest.mark.parametrize('emoji', ['hello', 5, ['👍']])
+def test_reaction_outside_allowed_set_is_rejected(token, monkeypatch, emoji):
+    cur = ScriptedCursor()
+    response, _ = call(load_function('messages'), 'PUT', token, cur, monkeypatch, {'message_id': 10, 'emoji': emoji})
+    
+    assert response['statusCode'] == 400
+    assert not cur.queries('FROM messages')
+
+def test_non_member_cannot_lock_the_message(token, monkeypatch):
+    cur = ScriptedCursor([
+        (r'SELECT chat_id FROM messages', [(5,)]),
+        (r'FROM chat_members WHERE user_id', [(1,)]),
+    ])
+    response, _ = call(load_function('messages'), 'PUT', token, cur, monkeypatch, {'message_id': 10, 'emoji': '👍'})
+    
+    assert response['statusCode'] == 403
+    assert not cur.queries('FOR UPDATE')
+
+def test_adding_a_reaction_increments_the_aggregate(token, monkeypatch):
+    cur = ScriptedCursor([
+        (r'SELECT chat_id FROM messages', [(5,)]),
+        (r'FROM chat_members WHERE user_id', [(5,)]),
+        (r'FOR UPDATE', [(10,)]),
+        (r'SELECT reactions FROM messages', [({'👍': 3},)]),
+    ])
+    response, conn = call(load_function('messages'), 'PUT', token, cur, monkeypatch, {'message_id': 10, 'emoji': '👍'})
+    
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == {'message_id': 10, 'reactions': {'👍': 3}}
+    adjustments = [params for query, params in cur.executed if query.startswith('UPDATE messages SET reactions')]
+    assert adjustments == [{'message_id': 10, 'emoji': '👍', 'delta': 1}]
+    assert cur.queries('INSERT INTO message_reactions')
+    assert conn.commits == 1
+
+def test_repeating_a_reaction_removes_it(token, monkeypatch):
+    cur = ScriptedCursor([
+        (r'SELECT chat_id FROM messages', [(5,)]),
+        (r'FROM chat_members WHERE user_id', [(5,)]),
+        (r'FOR UPDATE', [(10,)]),
+        (r'SELECT emoji FROM message_reactions', [('👍',)]),
+        (r'SELECT reactions FROM messages', [({},)]),
+    ])
+    response, _ = call(load_function('messages'), 'PUT', token, cur, monkeypatch, {'message_id': 10, 'emoji': '👍'})
+    
+    assert response['statusCode'] == 200
+    adjustments = [params for query, params in cur.executed if query.startswith('UPDATE messages SET reactions')]
+    assert adjustments == [{'message_id': 10, 'emoji': '👍', 'delta': -1}]
+    assert cur.queries('DELETE FROM message_reactions')
+    assert not cur.queries('INSERT INTO message_reactions')
+
+def test_history_embeds_reactions_and_seen_count(token, monkeypatch):
+    cur = ScriptedCursor([
+        (r'FROM chat_members WHERE user_id', [(5,)]),
+        (r'EXECUTE history', [
+            (11, 'yo', 'text', CREATED, None, 1, 'me', 'Me', '#0088cc', None, {}),
+            (10, 'hi', 'text', CREATED, None, 2, 'bob', 'Bob', '#0088cc', None, {'🔥': 2}),
+        ]),
+        (r'EXECUTE read_watermarks', [(1, 0), (2, 10), (3, 11)]),
+    ])
+    response, conn = call(load_function('messages'), 'GET', token, cur, monkeypatch, params={'chat_id': '5'})
+    
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    assert [(m['id'], m['reactions'], m['seen_count']) for m in body] == [(10, {'🔥': 2}, 2), (11, {}, 1)]
+    watermark_update = [params for query, params in cur.executed if query.startswith('UPDATE chat_members SET last_read_message_id')]
+    assert watermark_update == [(11, '5', 1, 11)]
+    assert conn.commits == 1
+
+def test_history_pages_back_from_before_id(token, monkeypatch):
+    messages = load_function('messages')
+    cur = ScriptedCursor([
+        (r'FROM chat_members WHERE user_id', [(5,)]),
+        (r'EXECUTE history', [(9, 'old', 'text', CREATED, None, 2, 'bob', 'Bob', '#0088cc', None, {})]),
+        (r'EXECUTE read_watermarks', [(1, 12), (2, 12)]),
+    ])
+    response, conn = call(messages, 'GET', token, cur, monkeypatch, params={'chat_id': '5', 'before_id': '10'})
+    
+    assert [m['id'] for m in json.loads(response['body'])] == [9]
+    history_params = [params for query, params in cur.executed if query.startswith('EXECUTE history')]
+    assert history_params == [('5', messages.HISTORY_LIMIT, 10)]
+    assert conn.commits == 0
+
+@pytest.mark.skipif(not os.environ.get('DATABASE_URL'), reason='DATABASE_URL is not set')
+def test_reaction_aggregate_arithmetic():
+    psycopg2 = pytest.importorskip('psycopg2')
+    messages = load_function('messages')
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute("CREATE TEMP TABLE messages (id INTEGER, reactions JSONB NOT NULL DEFAULT '{}')")
+    cur.execute("INSERT INTO messages (id) VALUES (1)")
+    
+    messages.adjust_reaction(cur, 1, '👍', 1)
+    messages.adjust_reaction(cur, 1, '👍', 1)
+    messages.adjust_reaction(cur, 1, '🔥', 1)
+    messages.adjust_reaction(cur, 1, '🔥', -1)
+    cur.execute("SELECT reactions FROM messages WHERE id = 1")
+    
+    assert cur.fetchone()[0] == {'👍': 2}
+    conn.close()
@@ -0,0 +1,65 @@
+import os
+import urllib.parse
+
+import pytest
+
+from conftest import BACKEND_DIR, load_function
+
+MIGRATION = os.path.join(os.path.dirname(BACKEND_DIR), 'db_migrations', 'V0006__create_jobs_queue.sql')
+
+def test_worker_rejects_calls_without_the_secret(monkeypatch):
+    monkeypatch.setenv('WORKER_SECRET', 'scheduler-secret')
+    worker = load_function('worker')
+    
+    for event in ({'httpMethod': 'POST'}, {'httpMethod': 'GET', 'headers': {'X-Worker-Secret': 'guess'}}):
+        assert worker.handler(event, None)['statusCode'] == 401
+
+def test_worker_is_closed_while_the_secret_is_unset(monkeypatch):
+    monkeypatch.delenv('WORKER_SECRET', raising=False)
+    worker = load_function('worker')
+    
+    assert worker.handler({'httpMethod': 'GET', 'headers': {'X-Worker-Secret': ''}}, None)['statusCode'] == 401
+
+@pytest.fixture
+def queue_url():
+    if not os.environ.get('DATABASE_URL'):
+        pytest.skip('DATABASE_URL is not set')
+    psycopg2 = pytest.importorskip('psycopg2')
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("DROP SCHEMA IF EXISTS worker_test CASCADE")
+    cur.execute("CREATE SCHEMA worker_test")
+    cur.execute("SET search_path TO worker_test")
+    cur.execute(open(MIGRATION).read())
+    separator = '&' if '?' in os.environ['DATABASE_URL'] else '?'
+    yield os.environ['DATABASE_URL'] + separator + 'options=' + urllib.parse.quote('-csearch_path=worker_test')
+    cur.execute("DROP SCHEMA worker_test CASCADE")
+    conn.close()
+
+def test_worker_drains_queue_and_backs_off_failures(queue_url, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', queue_url)
+    worker = load_function('worker')
+    worker.WORKER_CONCURRENCY = 2
+    worker.WORKER_BATCH_SIZE = 3
+    
+    def boom(cur, payload):
+        raise RuntimeError('boom')
+    
+    monkeypatch.setitem(worker.JOB_HANDLERS, 'noop', lambda cur, payload: None)
+    monkeypatch.setitem(worker.JOB_HANDLERS, 'boom', boom)
+    conn = worker.connect()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO jobs (kind) SELECT 'noop' FROM generate_series(1, 10)")
+    cur.execute("INSERT INTO jobs (kind) VALUES ('boom')")
+    conn.commit()
+    
+    result = worker.run_worker()
+    
+    assert (result['done'], result['retried'], result['failed']) == (10, 1, 0)
+    cur.execute("SELECT attempts, status, run_at > CURRENT_TIMESTAMP, last_error FROM jobs WHERE kind = 'boom'")
+    assert cur.fetchone() == (1, 'pending', True, "RuntimeError('boom')")
+    stats = worker.queue_stats(cur)
+    assert stats['done']['count'] == 10
+    assert stats['pending'] == {'count': 1, 'oldest_age_seconds': 0}
+    conn.close()